@@ -1,9 +1,27 @@
 import os
+import re
 import json
+import time
+import uuid
 import logging
 import numpy as np
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from inversion_utils import load_hyperstyle_model, load_stylegan2_generator, process_image, download_ganspace_components
+from PIL import Image
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, make_response,
+                   Response, stream_with_context, g, abort, send_from_directory)
+from inversion_utils import (load_hyperstyle_model, load_stylegan2_generator,
+                             check_ganspace_components, encode_image, render_variations,
+                             image_cache_key, init_mean_latent, render_preview, image_to_bytes,
+                             configure_inference, render_seeds, get_latent_cache, device,
+                             render_sweep, pack_sprite_sheet, get_feature_cache, canonical_edits,
+                             render_settings, encode_faces, composite_faces, latent_from_array)
+from image_store import ImageStore
+from latent_library import LatentLibrary, SEARCH_SPACES
+from metrics import registry as metrics, profiler, server_timing_header
+from model_registry import ModelRegistry
+from render_cache import RenderCache, make_render_key, noise_seed
+from render_queue import RenderQueue, QueueFull
+from sessions import SessionStore
+from transitions import INTERPOLATION_METHODS, count_frames, interpolate_edits, render_frame_batches, write_frame_archive
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -13,6 +31,23 @@ app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['OUTPUT_FOLDER'] = 'static/outputs'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
+SESSION_COOKIE = 'session_id'
+RENDER_TIMEOUT = 300
+PREVIEW_RESOLUTION = int(os.environ.get('PREVIEW_RESOLUTION', 256))
+GENERATOR_PATH = 'models/stylegan2-ada-pytorch/ffhq.pkl'
+MAX_SEEDS_PER_REQUEST = 16
+PERSIST_OUTPUTS = os.environ.get('PERSIST_OUTPUTS', '1') != '0'
+PRECOMPUTE_SWEEPS = os.environ.get('PRECOMPUTE_SWEEPS', '1') != '0'
+# Slider attributes whose single-attribute renders are precomputed as sprite sheets after upload
+SWEEP_ATTRIBUTES = ('smile', 'expression')
+SWEEP_VALUES = [float(v) for v in np.arange(-10, 10.5, 1.0)]
+SPRITE_COLUMNS = 7
+# Keyframe for "no scene": the edits of the first render after upload
+NEUTRAL_EDITS = {'truncation': 0.5, 'noise_strength': 1.0}
+MAX_TRANSITION_FRAMES = 240
+SERVER_TIMING = os.environ.get('SERVER_TIMING') == '1'
+PROFILER_ENABLED = os.environ.get('ENABLE_PROFILER') == '1'
+
 def load_products():
     """Loads the product catalog from the JSON file."""
     with open('products.json', 'r') as f:
@@ -23,101 +58,344 @@ def load_scenes():
     with open('scenes.json', 'r') as f:
         return json.load(f)
 
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
-os.makedirs(os.path.join(app.config['OUTPUT_FOLDER'], 'products'), exist_ok=True)
+sessions = SessionStore(app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'],
+                        ttl_seconds=int(os.environ.get('SESSION_TTL_SECONDS', 6 * 3600)))
+sessions.collect_garbage()
+image_store = ImageStore(max_bytes=int(os.environ.get('IMAGE_STORE_BYTES', 256 * 1024 * 1024)))
+# Finished renders are persisted here, shared across sessions, unless PERSIST_OUTPUTS=0
+render_cache = RenderCache(image_store,
+                           cache_dir=os.environ.get('RENDER_CACHE_DIR', 'cache/renders') if PERSIST_OUTPUTS else None,
+                           max_entries=int(os.environ.get('RENDER_CACHE_SIZE', 1024)),
+                           max_disk_bytes=int(os.environ.get('RENDER_CACHE_DISK_BYTES', 1024 ** 3)))
+# Saved identities outlive sessions so they can be searched and re-edited without a new upload
+library = LatentLibrary(os.environ.get('LATENT_LIBRARY_DIR', 'library'))
+
+
+def current_session():
+    """Returns the session ID from the request cookie if it still exists."""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if sessions.exists(session_id):
+        sessions.touch(session_id)
+        return session_id
+    return None
+
+
+def session_paths(session_id):
+    """File locations for one session's upload and renders."""
+    upload_dir = sessions.upload_dir(session_id)
+    output_dir = sessions.output_dir(session_id) if PERSIST_OUTPUTS else None
+    return {
+        'upload': os.path.join(upload_dir, 'uploaded_image.png'),
+        'attributes': os.path.join(upload_dir, 'last_attributes.json'),
+        'outputs': output_dir,
+    }
+
+
+def original_image_url(session_id, versioned=True):
+    """URL of the session's uploaded photo, with an mtime query to bust browser caches.
+
+    The upload is served by a route that checks the session cookie, since its
+    folder is named after the session ID and must not appear in page URLs.
+    """
+    if not versioned:
+        return url_for('original_image')
+    return url_for('original_image', t=os.path.getmtime(session_paths(session_id)['upload']))
+
 
+def image_url(digest):
+    return url_for('serve_image', digest=digest)
 
-logger.info("Clearing previous session files to ensure a fresh start...")
-folders_to_clear = [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]
-for folder in folders_to_clear:
-    if os.path.exists(folder):
-        for dirpath, dirnames, filenames in os.walk(folder):
-            for filename in filenames:
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                        logger.info(f"Removed old file: {file_path}")
-                except Exception as e:
-                    logger.error(f"Failed to remove {file_path}. Reason: {e}")
+
+def session_image_url(session_id, slot):
+    """URL of the image a session last rendered into a named slot, if any."""
+    digest = sessions.load_meta(session_id).get('images', {}).get(slot)
+    return image_url(digest) if digest else None
 
 
 # --- Load Models ---
-logger.info("Initializing GANSpace components...")
-download_ganspace_components('models/ganspace')
+def load_ganspace(models):
+    check_ganspace_components('models/ganspace')
+
+
+def load_mean_latent(models):
+    return init_mean_latent(models['generator'], GENERATOR_PATH,
+                            source=os.environ.get('MEAN_LATENT_SOURCE', 'sampled'))
+
+
+def load_inference_mode(models):
+    return configure_inference(models['generator'], mode=os.environ.get('INFERENCE_MODE', 'fp32'),
+                               batch_size=int(os.environ.get('INFERENCE_BATCH_SIZE', 1)),
+                               tolerance_db=float(os.environ.get('INFERENCE_PSNR_DB', 35.0)))
+
+
+models = ModelRegistry([
+    ('ganspace', load_ganspace),
+    ('encoder', lambda models: load_hyperstyle_model('models/hyperstyle/hyperstyle_ffhq.pt')),
+    ('generator', lambda models: load_stylegan2_generator(GENERATOR_PATH)),
+    ('mean_latent', load_mean_latent),
+    ('inference_mode', load_inference_mode),
+])
+
+# Models load in the background so the server answers /healthz and /readyz while
+# they load; PRELOAD_MODELS=1 loads them inline for scripts that need them at import,
+# and DEFER_MODEL_LOADING=1 leaves loading to the importer (benchmark.py swaps in stand-ins).
+if os.environ.get('PRELOAD_MODELS') == '1':
+    logger.info("Loading AI models...")
+    models.load()
+elif os.environ.get('DEFER_MODEL_LOADING') != '1':
+    logger.info("Loading AI models in the background...")
+    models.start()
+
+
+def session_latent(session_id):
+    """W+ latent of a session's face: a recalled library identity, or the (cached) inversion of its upload."""
+    library_id = sessions.load_meta(session_id).get('library_id')
+    if library_id:
+        return latent_from_array(library.get(library_id))
+    return encode_image(session_paths(session_id)['upload'], models.get('encoder', RENDER_TIMEOUT))
+
+
+def loaded_render_settings():
+    """render_settings() once the models are loaded, else None: earlier keys would lack the checkpoint checksums."""
+    return render_settings() if models.ready else None
+
+
+def render_jobs(jobs):
+    """Renders a batch of queued jobs that share one uploaded face, once per distinct edit set."""
+    digests = {}
+    missing = {}
+    for job in jobs:
+        if job.payload['render_key'] is None:
+            models.wait(RENDER_TIMEOUT)
+            job.payload['render_key'] = make_render_key(job.payload['latent_key'],
+                                                        canonical_edits(job.payload['edits']), render_settings())
+        render_key = job.payload['render_key']
+        digest = render_cache.get(render_key)
+        if digest:
+            digests[render_key] = digest
+        else:
+            missing.setdefault(render_key, job.payload['edits'])
+
+    if missing:
+        generator = models.get('generator', RENDER_TIMEOUT)
+        latent_codes = session_latent(jobs[0].payload['session_id'])
+        images = render_variations(latent_codes, generator, list(missing.values()),
+                                   noise_seeds=[noise_seed(key) for key in missing])
+        for render_key, img in zip(missing, images):
+            digests[render_key] = render_cache.put(render_key, image_to_bytes(img), 'image/png')
 
-logger.info("Loading AI models...")
-encoder = load_hyperstyle_model('models/hyperstyle/hyperstyle_ffhq.pt')
-generator = load_stylegan2_generator('models/stylegan2-ada-pytorch/ffhq.pkl')
-logger.info("AI models loaded successfully.")
+    for job in jobs:
+        sessions.set_image(job.payload['session_id'], job.payload['slot'], digests[job.payload['render_key']])
+    return [digests[job.payload['render_key']] for job in jobs]
+
+
+render_queue = RenderQueue(render_jobs,
+                           max_pending=int(os.environ.get('RENDER_QUEUE_SIZE', 32)))
+
+
+def submit_render(session_id, edits, slot):
+    """Queues a render of the session's upload with the given edits into a named image slot.
+
+    Edit sets rendered before for the same face are answered from the render
+    cache with an already finished job. Before the models are loaded the
+    render key is left for the worker to compute.
+    """
+    paths = session_paths(session_id)
+    latent_key = sessions.load_meta(session_id).get('latent_key') or image_cache_key(paths['upload'])
+    settings = loaded_render_settings()
+    render_key = make_render_key(latent_key, canonical_edits(edits), settings) if settings else None
+
+    digest = render_cache.get(render_key) if render_key else None
+    if digest:
+        metrics.inc('render_cache_requests_total', result='hit')
+        sessions.set_image(session_id, slot, digest)
+        return render_queue.add_finished(digest)
+
+    metrics.inc('render_cache_requests_total', result='miss')
+    return render_queue.submit(latent_key, {
+        'session_id': session_id,
+        'edits': edits,
+        'slot': slot,
+        'latent_key': latent_key,
+        'render_key': render_key,
+    })
+
+
+def wait_for_jobs(jobs):
+    """Blocks until every job has finished and raises on the first failure."""
+    for job in jobs:
+        if not job.wait(RENDER_TIMEOUT):
+            raise TimeoutError("Timed out waiting for the render worker")
+        g.setdefault('stage_timings', []).extend(job.stage_timings())
+        if job.error:
+            raise RuntimeError(job.error)
+
+
+# --- Metrics ---
+_model_bytes = {}
+
+
+def model_bytes(name):
+    """Parameter and buffer memory of a loaded model, measured once."""
+    if not models.ready:
+        return 0
+    if name not in _model_bytes:
+        model = models.models[name]
+        tensors = list(model.parameters()) + list(model.buffers())
+        _model_bytes[name] = sum(t.numel() * t.element_size() for t in tensors)
+    return _model_bytes[name]
+
+
+def resident_memory_bytes():
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+metrics.describe('http_request_seconds', "Flask request latency by endpoint")
+metrics.describe('render_queue_wait_seconds', "Time jobs spend queued before the worker picks them up")
+metrics.gauge('render_queue_depth', render_queue.depth)
+metrics.gauge('models_ready', lambda: models.ready)
+for model_name in ('encoder', 'generator'):
+    metrics.gauge('model_memory_bytes', lambda name=model_name: model_bytes(name), model=model_name)
+metrics.gauge('image_store_bytes', lambda: image_store.size_bytes)
+metrics.gauge('image_store_entries', lambda: len(image_store))
+metrics.gauge('latent_cache_entries', lambda: len(get_latent_cache()))
+metrics.gauge('render_cache_entries', lambda: len(render_cache))
+metrics.gauge('latent_library_entries', lambda: len(library))
+if get_feature_cache() is not None:
+    metrics.gauge('feature_cache_bytes', lambda: get_feature_cache().size_bytes)
+metrics.gauge('process_resident_memory_bytes', resident_memory_bytes)
+if device == 'cuda':
+    import torch
+    metrics.gauge('cuda_memory_allocated_bytes', torch.cuda.memory_allocated)
+    metrics.gauge('cuda_max_memory_allocated_bytes', torch.cuda.max_memory_allocated)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('http_request_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+    if SERVER_TIMING:
+        timings = g.get('stage_timings', []) + [('total', elapsed)]
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+
+def queue_full_response(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
+
+def submit_sweeps(session_id):
+    """Queues background sprite sheet renders of each slider attribute for a fresh upload."""
+    persist_dir = session_paths(session_id)['outputs']
+    base_edits = customization_edits({})
+
+    def sweep_task(job, attribute):
+        latent_codes = session_latent(session_id)
+        frames = render_sweep(latent_codes, models.get('generator', RENDER_TIMEOUT), base_edits,
+                              attribute, SWEEP_VALUES, resolution=PREVIEW_RESOLUTION)
+        sheet = pack_sprite_sheet(frames, SPRITE_COLUMNS)
+        digest = image_store.put(image_to_bytes(sheet, format='JPEG', quality=85), 'image/jpeg',
+                                 persist_dir=persist_dir)
+        sessions.set_sprite(session_id, attribute, {
+            'digest': digest,
+            'values': SWEEP_VALUES,
+            'columns': SPRITE_COLUMNS,
+            'frame_size': frames[0].width,
+        })
+        return digest
+
+    # One task per attribute so interactive renders can slot in between them
+    for i, attribute in enumerate(SWEEP_ATTRIBUTES):
+        try:
+            render_queue.submit_task(sweep_task, attribute)
+        except QueueFull:
+            skipped = list(SWEEP_ATTRIBUTES[i:])
+            logger.info(f"Render queue is busy, skipping the {', '.join(skipped)} sweep(s)")
+            # Recorded so /customize/sprites stops reporting these as pending
+            sessions.update_meta(session_id, skipped_sweeps=skipped)
+            break
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    upload_filename = 'uploaded_image.png'
-    output_filename = 'synthetic_image.png'
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], upload_filename)
-    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    session_id = current_session()
 
     if request.method == 'POST':
         if 'file' in request.files and request.files['file'].filename != '':
-            logger.info("New image uploaded. Clearing all previous session files...")
-            for folder in folders_to_clear:
-                if os.path.exists(folder):
-                    for dirpath, dirnames, filenames in os.walk(folder):
-                        for filename in filenames:
-                            file_path = os.path.join(dirpath, filename)
-                            if os.path.isfile(file_path):
-                                try:
-                                    os.remove(file_path)
-                                except OSError as e:
-                                    logger.error(f"Error removing file {file_path}: {e}")
-            
+            sessions.maybe_collect_garbage()
+            session_id = sessions.create()
+            paths = session_paths(session_id)
+
             file = request.files['file']
-            file.save(upload_path)
-            logger.info(f"Saved uploaded file to {upload_path}")
+            file.save(paths['upload'])
+            logger.info(f"Saved uploaded file to {paths['upload']}")
+            sessions.update_meta(session_id, latent_key=image_cache_key(paths['upload']))
             
             try:
-                process_image(
-                    upload_path, encoder, generator, output_path,
-                    truncation=0.5,
-                    noise_strength=1.0
-                )
+                job = submit_render(session_id, {'truncation': 0.5, 'noise_strength': 1.0}, 'synthetic')
+                wait_for_jobs([job])
                 logger.info("Image processed successfully.")
+                if PRECOMPUTE_SWEEPS:
+                    submit_sweeps(session_id)
             except Exception as e:
                 logger.error(f"Error processing image: {e}")
-                return render_template('index.html', error=f"Error processing image: {str(e)}")
+                response = make_response(render_template('index.html', error=f"Error processing image: {str(e)}"))
+                response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+                return response
 
     original_image, synthetic_image = None, None
-    if os.path.exists(upload_path) and os.path.exists(output_path):
-        original_image = f"/{app.config['UPLOAD_FOLDER']}/{upload_filename}?t={os.path.getmtime(upload_path)}"
-        synthetic_image = f"/{app.config['OUTPUT_FOLDER']}/{output_filename}?t={os.path.getmtime(output_path)}"
-
-    return render_template('index.html', 
-                         original_image=original_image,
-                         synthetic_image=synthetic_image)
+    if session_id:
+        synthetic_image = session_image_url(session_id, 'synthetic')
+        if synthetic_image:
+            original_image = original_image_url(session_id)
+
+    response = make_response(render_template('index.html', 
+                                             original_image=original_image,
+                                             synthetic_image=synthetic_image))
+    if session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+
+def customization_edits(data):
+    """Converts the /customize slider payload into an edits dict."""
+    return {
+        'truncation': float(data.get('truncation', 0.5)), 'noise_strength': float(data.get('noise_strength', 1.0)),
+        'gender': float(data.get('gender', 0)), 'smile': float(data.get('smile', 0)), 'pose': float(data.get('pose', 0)),
+        'age': float(data.get('age', 0)), 'lighting': float(data.get('lighting', 0)), 'hair_color': float(data.get('hair_color', 0)),
+        'hair_length': float(data.get('hair_length', 0)), 'expression': float(data.get('expression', 0)),
+        'eye_color': float(data.get('eye_color', 0)), 'eye_state': float(data.get('eye_state', 0)),
+        'serious_mood': max(0.0, float(data.get('serious_mood', 0))), 'maturity': float(data.get('maturity', 0))
+    }
 
 
 @app.route('/customize', methods=['GET', 'POST'])
 def customize():
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], 'uploaded_image.png')
-    custom_output_path = os.path.join(app.config['OUTPUT_FOLDER'], 'customized_image.png')
-    attributes_path = os.path.join(app.config['OUTPUT_FOLDER'], 'last_attributes.json')
+    session_id = current_session()
 
     if request.method == 'GET':
-        if not os.path.exists(upload_path):
+        if not session_id:
             return render_template('customize.html', synthetic_image=None, original_image=None)
 
-        original_image = f"/{app.config['UPLOAD_FOLDER']}/uploaded_image.png"
+        paths = session_paths(session_id)
+        original_image = original_image_url(session_id, versioned=False)
 
-        if os.path.exists(custom_output_path):
-            synthetic_image = f"/{app.config['OUTPUT_FOLDER']}/customized_image.png?t={os.path.getmtime(custom_output_path)}"
-        else:
-            synthetic_image = f"/{app.config['OUTPUT_FOLDER']}/synthetic_image.png"
+        synthetic_image = (session_image_url(session_id, 'customized')
+                           or session_image_url(session_id, 'synthetic'))
         
-        if os.path.exists(attributes_path):
-            with open(attributes_path, 'r') as f:
+        if os.path.exists(paths['attributes']):
+            with open(paths['attributes'], 'r') as f:
                 attributes = json.load(f)
         else:
             attributes = {
@@ -134,29 +412,74 @@ def customize():
                              attributes=attributes)
 
     if request.method == 'POST':
+        if not session_id:
+            return jsonify({'error': 'No base image found. Please start over.'}), 400
+
+        paths = session_paths(session_id)
         data = request.json
         try:
-            process_image(
-                upload_path, encoder, generator, custom_output_path, 
-                truncation=float(data.get('truncation', 0.5)), noise_strength=float(data.get('noise_strength', 1.0)),
-                gender=float(data.get('gender', 0)), smile=float(data.get('smile', 0)), pose=float(data.get('pose', 0)),
-                age=float(data.get('age', 0)), lighting=float(data.get('lighting', 0)), hair_color=float(data.get('hair_color', 0)),
-                hair_length=float(data.get('hair_length', 0)), expression=float(data.get('expression', 0)),
-                eye_color=float(data.get('eye_color', 0)), eye_state=float(data.get('eye_state', 0)),
-                serious_mood=max(0.0, float(data.get('serious_mood', 0))), maturity=float(data.get('maturity', 0))
-            )
-            with open(attributes_path, 'w') as f:
+            edits = customization_edits(data)
+            job = submit_render(session_id, edits, 'customized')
+            with open(paths['attributes'], 'w') as f:
                 json.dump(data, f)
-            return jsonify({'synthetic_image': f"/{app.config['OUTPUT_FOLDER']}/customized_image.png?t={os.path.getmtime(custom_output_path)}"})
+            return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+        except QueueFull as e:
+            return queue_full_response(e)
         except Exception as e:
             return jsonify({'error': f'Error applying customizations: {str(e)}'}), 500
 
 
 
+@app.route('/customize/preview', methods=['POST'])
+def customize_preview():
+    """Returns a low-resolution JPEG of the current slider values for live dragging."""
+    session_id = current_session()
+    if not session_id:
+        return jsonify({'error': 'No base image found. Please start over.'}), 400
+
+    edits = customization_edits(request.json)
+
+    def preview_task(job):
+        latent_codes = session_latent(session_id)
+        return render_preview(latent_codes, models.get('generator', RENDER_TIMEOUT), edits,
+                              resolution=PREVIEW_RESOLUTION)
+
+    try:
+        job = render_queue.submit_task(preview_task)
+        wait_for_jobs([job])
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Error rendering preview: {str(e)}'}), 500
+
+    return Response(job.result, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+
+
+@app.route('/customize/sprites')
+def customize_sprites():
+    """Lists the precomputed attribute sweeps the client can scrub without a server render."""
+    session_id = current_session()
+    if not session_id:
+        return jsonify({'error': 'No base image found. Please start over.'}), 400
+
+    meta = sessions.load_meta(session_id)
+    sprites = meta.get('sprites', {})
+    expected = set(SWEEP_ATTRIBUTES) - set(meta.get('skipped_sweeps', []))
+    return jsonify({
+        'base': customization_edits({}),
+        'pending': PRECOMPUTE_SWEEPS and not expected <= set(sprites),
+        'sprites': {attribute: dict(sprite, url=image_url(sprite['digest']))
+                    for attribute, sprite in sprites.items()},
+    })
+
+
+
 @app.route('/marketing')
 def marketing():
     """Renders the marketing dashboard, checking for a base image first."""
-    if not os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], 'synthetic_image.png')):
+    session_id = current_session()
+    if not session_id or not session_image_url(session_id, 'synthetic'):
         return render_template('marketing.html', products_available=False)
 
     featured_ids = ["eye_color_lenses", "beard_grooming"]
@@ -182,27 +505,35 @@ def product_detail(product_id):
     if not product:
         return "Product not found", 404
 
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], 'uploaded_image.png')
-    if not os.path.exists(upload_path):
+    session_id = current_session()
+    if not session_id:
         return redirect(url_for('index'))
 
-    output_dir = os.path.join(app.config['OUTPUT_FOLDER'], 'products')
-    
     image_urls = []
     labels = []
-    base_image_url = f"/{app.config['OUTPUT_FOLDER']}/synthetic_image.png"
+    base_image_url = session_image_url(session_id, 'synthetic')
 
     if 'variations' in product:
-        for i, variation in enumerate(product['variations']):
-            if variation['edits'] == 'input':
-                labels.append(variation.get('label', 'Input Image'))
-                image_urls.append(base_image_url)
-            else:
-                labels.append(variation['label'])
-                variation_filename = f"product_{product_id}_var{i}.png"
-                variation_path = os.path.join(output_dir, variation_filename)
-                process_image(upload_path, encoder, generator, variation_path, **variation['edits'])
-                image_urls.append(f"/{variation_path.replace(os.sep, '/')}")
+        pending = []
+        try:
+            for i, variation in enumerate(product['variations']):
+                if variation['edits'] == 'input':
+                    labels.append(variation.get('label', 'Input Image'))
+                    image_urls.append(base_image_url)
+                else:
+                    labels.append(variation['label'])
+                    slot = f"product_{product_id}_var{i}"
+                    pending.append((len(image_urls), submit_render(session_id, variation['edits'], slot)))
+                    image_urls.append(None)
+
+            wait_for_jobs([job for _, job in pending])
+        except QueueFull:
+            return "Server is busy, please retry shortly", 503
+        except (RuntimeError, TimeoutError) as e:
+            logger.error(f"Error rendering product {product_id}: {e}")
+            return f"Error rendering product images: {e}", 500
+        for index, job in pending:
+            image_urls[index] = image_url(job.result)
         
     else:
         labels.append("Input Image")
@@ -217,11 +548,12 @@ def product_detail(product_id):
 @app.route('/filmmaking')
 def filmmaking():
     """Renders the filmmaking 'Director's Panel' page."""
-    if not os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], 'synthetic_image.png')):
+    session_id = current_session()
+    synthetic_image = session_image_url(session_id, 'synthetic') if session_id else None
+    if not synthetic_image:
         return redirect(url_for('index'))
 
     scenes = load_scenes()
-    synthetic_image = f"/{app.config['OUTPUT_FOLDER']}/synthetic_image.png?t={os.path.getmtime(os.path.join(app.config['OUTPUT_FOLDER'], 'synthetic_image.png'))}"
     
     return render_template('filmmaking.html', 
                            scenes=list(scenes.values()),
@@ -231,24 +563,442 @@ def filmmaking():
 @app.route('/apply_scene', methods=['POST'])
 def apply_scene():
     """API endpoint to apply a pre-defined scene's edits."""
-    if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], 'uploaded_image.png')):
+    session_id = current_session()
+    if not session_id:
         return jsonify({'error': 'No base image found. Please start over.'}), 400
 
     data = request.json
     edits = data.get('edits', {})
 
-    scene_output_path = os.path.join(app.config['OUTPUT_FOLDER'], 'scene_image.png')
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], 'uploaded_image.png')
-
     try:
-        process_image(upload_path, encoder, generator, scene_output_path, **edits)
-        
-        image_url = f"/{scene_output_path.replace(os.sep, '/')}?t={os.path.getmtime(scene_output_path)}"
-        return jsonify({'new_image_url': image_url})
-        
+        job = submit_render(session_id, edits, 'scene')
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         logger.error(f"Error applying scene: {e}")
         return jsonify({'error': str(e)}), 500
     
+@app.route('/filmmaking/transition', methods=['POST'])
+def create_transition():
+    """API endpoint that renders an interpolated clip between scenes into a downloadable frame archive."""
+    session_id = current_session()
+    if not session_id:
+        return jsonify({'error': 'No base image found. Please start over.'}), 400
+
+    data = request.json or {}
+    scenes = load_scenes()
+    scene_ids = data.get('scenes', [])
+    if len(scene_ids) < 2:
+        return jsonify({'error': 'Pick at least two scenes.'}), 400
+    unknown = [scene_id for scene_id in scene_ids if scene_id != 'neutral' and scene_id not in scenes]
+    if unknown:
+        return jsonify({'error': f"Unknown scene(s): {', '.join(unknown)}"}), 400
+    keyframes = [NEUTRAL_EDITS if scene_id == 'neutral' else scenes[scene_id]['edits'] for scene_id in scene_ids]
+
+    method = data.get('method', 'linear')
+    if method not in INTERPOLATION_METHODS:
+        return jsonify({'error': f"Method must be one of {', '.join(INTERPOLATION_METHODS)}."}), 400
+    try:
+        frames_per_segment = int(data.get('frames', 24))
+        fps = int(data.get('fps', 24))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Frames and fps must be integers.'}), 400
+    total_frames = count_frames(len(keyframes), frames_per_segment)
+    if frames_per_segment < 1 or total_frames > MAX_TRANSITION_FRAMES:
+        return jsonify({'error': f'A clip can have at most {MAX_TRANSITION_FRAMES} frames.'}), 400
+
+    clip_id = uuid.uuid4().hex
+    clip_path = os.path.join(sessions.output_dir(session_id), f"transition_{clip_id}.zip")
+    download_url = url_for('download_clip', clip_id=clip_id)
+
+    def transition_task(job):
+        # One synthesis batch per turn on the render worker, so previews queued
+        # behind a long clip are not stuck waiting for all of it
+        latent_codes = session_latent(session_id)
+        batches = render_frame_batches(latent_codes, models.get('generator', RENDER_TIMEOUT),
+                                       interpolate_edits(keyframes, frames_per_segment, method))
+        for done in write_frame_archive(batches, clip_path, fps=fps,
+                                        manifest={'scenes': scene_ids, 'method': method}):
+            job.set_progress(done / total_frames)
+            yield
+        return {'download_url': download_url}
+
+    try:
+        job = render_queue.submit_steps(transition_task)
+    except QueueFull as e:
+        return queue_full_response(e)
+    return jsonify({'job_id': job.id, 'frames': total_frames,
+                    'status_url': url_for('job_status', job_id=job.id)}), 202
+
+
+@app.route('/clips/<clip_id>')
+def download_clip(clip_id):
+    """Downloads a finished transition clip from the session's output folder."""
+    session_id = current_session()
+    if not session_id or not sessions.is_valid_id(clip_id):
+        return "Clip not found", 404
+    return send_from_directory(sessions.output_dir(session_id), f"transition_{clip_id}.zip",
+                               as_attachment=True, download_name='transition.zip')
+
+
+@app.route('/group', methods=['POST'])
+def group():
+    """API endpoint that inverts and edits every face of a group photo in one batched pass."""
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'error': 'Upload a group photo as "file".'}), 400
+    try:
+        edits = json.loads(request.form.get('edits') or 'null') or NEUTRAL_EDITS
+    except ValueError:
+        return jsonify({'error': 'Edits must be a JSON object.'}), 400
+    make_composite = request.form.get('composite', '1') != '0'
+
+    session_id = current_session()
+    if not session_id:
+        sessions.maybe_collect_garbage()
+        session_id = sessions.create()
+    group_path = os.path.join(sessions.upload_dir(session_id), f"group_{uuid.uuid4().hex}.png")
+    request.files['file'].save(group_path)
+    persist_dir = session_paths(session_id)['outputs']
+
+    def group_task(job):
+        latent_codes, boxes = encode_faces(group_path, models.get('encoder', RENDER_TIMEOUT))
+        faces = render_variations(latent_codes, models.get('generator', RENDER_TIMEOUT), [edits] * len(boxes))
+        result = {
+            'face_digests': [image_store.put(image_to_bytes(face), 'image/png', persist_dir=persist_dir)
+                             for face in faces],
+            'boxes': boxes,
+        }
+        if make_composite:
+            composite = composite_faces(Image.open(group_path).convert('RGB'), faces, boxes)
+            result['composite_digest'] = image_store.put(image_to_bytes(composite), 'image/png',
+                                                         persist_dir=persist_dir)
+        return result
+
+    try:
+        job = render_queue.submit_task(group_task)
+    except QueueFull as e:
+        return queue_full_response(e)
+    response = jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)})
+    response.status_code = 202
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    """API endpoint that renders new identities from seeds, without an upload or the encoder."""
+    data = request.json or {}
+    try:
+        if 'seeds' in data:
+            seeds = [int(seed) for seed in data['seeds']]
+        else:
+            start = int(data.get('seed', np.random.randint(2 ** 31)))
+            count = int(data.get('count', 1))
+            # Check the count before building the range so a huge one cannot exhaust memory
+            if not 1 <= count <= MAX_SEEDS_PER_REQUEST:
+                return jsonify({'error': f'Request between 1 and {MAX_SEEDS_PER_REQUEST} seeds.'}), 400
+            seeds = list(range(start, start + count))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': 'Seeds must be integers.'}), 400
+    if not seeds or len(seeds) > MAX_SEEDS_PER_REQUEST:
+        return jsonify({'error': f'Request between 1 and {MAX_SEEDS_PER_REQUEST} seeds.'}), 400
+    if any(seed < 0 or seed >= 2 ** 32 for seed in seeds):
+        return jsonify({'error': 'Seeds must be between 0 and 2**32 - 1.'}), 400
+    edits = data.get('edits', {})
+    try:
+        # render_seeds always renders with constant noise
+        seed_edits = canonical_edits(dict(edits, noise_strength=0.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Edits must map attribute names to numbers.'}), 400
+
+    def seed_render_keys(settings):
+        return [make_render_key(f"seed-{seed}", seed_edits, settings) for seed in seeds]
+
+    settings = loaded_render_settings()
+    if settings:
+        digests = [render_cache.get(key) for key in seed_render_keys(settings)]
+        if all(digests):
+            metrics.inc('render_cache_requests_total', result='hit')
+            job = render_queue.add_finished(digests)
+            return jsonify({'job_id': job.id, 'seeds': seeds,
+                            'status_url': url_for('job_status', job_id=job.id)}), 202
+    metrics.inc('render_cache_requests_total', result='miss')
+
+    def seed_task(job):
+        generator = models.get('generator', RENDER_TIMEOUT)
+        render_keys = seed_render_keys(render_settings())
+        results = [render_cache.get(key) for key in render_keys]
+        missing = [i for i, digest in enumerate(results) if not digest]
+        if missing:
+            images = render_seeds(generator, [seeds[i] for i in missing], edits)
+            for i, img in zip(missing, images):
+                results[i] = render_cache.put(render_keys[i], image_to_bytes(img), 'image/png')
+        return results
+
+    try:
+        job = render_queue.submit_task(seed_task)
+    except QueueFull as e:
+        return queue_full_response(e)
+    return jsonify({'job_id': job.id, 'seeds': seeds,
+                    'status_url': url_for('job_status', job_id=job.id)}), 202
+
+
+def library_entry(entry):
+    """A library entry as returned to clients, with its thumbnail URL."""
+    entry = {key: value for key, value in entry.items() if key != 'row'}
+    if library.thumbnail_path(entry['id']):
+        entry['thumbnail_url'] = url_for('library_thumbnail', entry_id=entry['id'])
+    return entry
+
+
+def thumbnail_bytes(path, size=256):
+    img = Image.open(path).convert('RGB')
+    img.thumbnail((size, size))
+    return image_to_bytes(img, format='JPEG', quality=90)
+
+
+@app.route('/library', methods=['GET', 'POST'])
+def latent_library():
+    """Lists saved identities, or saves the current session's face to the library."""
+    if request.method == 'GET':
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer.'}), 400
+        entries = library.list(request.args.get('q'), limit=limit)
+        return jsonify({'entries': [library_entry(entry) for entry in entries], 'total': len(library)})
+
+    session_id = current_session()
+    if not session_id:
+        return jsonify({'error': 'No base image found. Please start over.'}), 400
+
+    data = request.json or {}
+    tags = data.get('tags', [])
+    if not isinstance(tags, list):
+        return jsonify({'error': 'Tags must be a list.'}), 400
+    meta = sessions.load_meta(session_id)
+    upload_path = session_paths(session_id)['upload']
+
+    def save_task(job):
+        latent_codes = session_latent(session_id)
+        entry = library.add(latent_codes.cpu().numpy(), name=str(data.get('name', '')),
+                            tags=[str(tag) for tag in tags], source=meta.get('latent_key'),
+                            thumbnail=thumbnail_bytes(upload_path))
+        # Runs on the render worker, outside the app context; job_state adds the URLs
+        return {'entry': entry}
+
+    try:
+        job = render_queue.submit_task(save_task)
+    except QueueFull as e:
+        return queue_full_response(e)
+    return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+
+
+@app.route('/library/<entry_id>/thumbnail')
+def library_thumbnail(entry_id):
+    if entry_id not in library or not library.thumbnail_path(entry_id):
+        return "Thumbnail not found", 404
+    return send_from_directory(os.path.dirname(library.thumbnail_path(entry_id)), f"{entry_id}.jpg")
+
+
+@app.route('/library/similar')
+def library_similar():
+    """Nearest saved identities to a library entry (?id=) or, without one, to the current session's face."""
+    space = request.args.get('space', 'w')
+    if space not in SEARCH_SPACES:
+        return jsonify({'error': f"Space must be one of {', '.join(SEARCH_SPACES)}."}), 400
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        return jsonify({'error': 'k must be an integer.'}), 400
+    if k < 1:
+        return jsonify({'error': 'k must be at least 1.'}), 400
+
+    entry_id = request.args.get('id')
+    if entry_id:
+        if entry_id not in library:
+            return jsonify({'error': 'Unknown library entry'}), 404
+        matches = library.search(library.get(entry_id), k=k, space=space, exclude={entry_id})
+        return jsonify({'matches': [library_entry(match) for match in matches]})
+
+    session_id = current_session()
+    if not session_id:
+        return jsonify({'error': 'No base image found. Please start over.'}), 400
+
+    def search_task(job):
+        latent_codes = session_latent(session_id)
+        return {'matches': library.search(latent_codes.cpu().numpy(), k=k, space=space)}
+
+    try:
+        job = render_queue.submit_task(search_task)
+        wait_for_jobs([job])
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Error searching the library: {str(e)}'}), 500
+    return jsonify({'matches': [library_entry(match) for match in job.result['matches']]})
+
+
+@app.route('/library/<entry_id>/use', methods=['POST'])
+def use_library_entry(entry_id):
+    """Starts a new session from a saved identity, ready to edit without an upload or inversion."""
+    if entry_id not in library:
+        return jsonify({'error': 'Unknown library entry'}), 404
+
+    sessions.maybe_collect_garbage()
+    session_id = sessions.create()
+    upload_path = session_paths(session_id)['upload']
+    sessions.update_meta(session_id, latent_key=f"library-{entry_id}", library_id=entry_id)
+
+    try:
+        job = submit_render(session_id, NEUTRAL_EDITS, 'synthetic')
+        wait_for_jobs([job])
+        if PRECOMPUTE_SWEEPS:
+            submit_sweeps(session_id)
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        logger.error(f"Error recalling library entry {entry_id}: {e}")
+        return jsonify({'error': f'Error recalling the face: {str(e)}'}), 500
+
+    # The thumbnail stands in for the upload as the session's "original" image
+    thumbnail_path = library.thumbnail_path(entry_id)
+    if thumbnail_path:
+        with open(thumbnail_path, 'rb') as src, open(upload_path, 'wb') as dst:
+            dst.write(src.read())
+    else:
+        entry = image_store.get(job.result, [render_cache.cache_dir] if render_cache.cache_dir else [])
+        if entry is not None:
+            with open(upload_path, 'wb') as f:
+                f.write(entry[0])
+
+    response = jsonify({'entry': library_entry(library.entries[entry_id]),
+                        'image_url': image_url(job.result), 'redirect': url_for('customize')})
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+
+def job_state(job):
+    state = job.to_dict()
+    if job.status == 'done' and isinstance(job.result, str):
+        state['image_url'] = image_url(job.result)
+    elif job.status == 'done' and isinstance(job.result, list):
+        state['image_urls'] = [image_url(digest) for digest in job.result]
+    elif job.status == 'done' and isinstance(job.result, dict):
+        # Task results name images by digest; hand them to the client as URLs
+        for key, value in job.result.items():
+            if key.endswith('_digest'):
+                state[key[:-len('_digest')] + '_url'] = image_url(value)
+            elif key.endswith('_digests'):
+                state[key[:-len('_digests')] + '_urls'] = [image_url(digest) for digest in value]
+            elif key == 'entry':
+                state[key] = library_entry(value)
+            elif key == 'matches':
+                state[key] = [library_entry(match) for match in value]
+            else:
+                state[key] = value
+    return state
+
+
+@app.route('/original')
+def original_image():
+    """Serves the current session's uploaded photo."""
+    session_id = current_session()
+    if not session_id:
+        return "Image not found", 404
+    return send_from_directory(sessions.upload_dir(session_id), 'uploaded_image.png')
+
+
+@app.route('/images/<digest>')
+def serve_image(digest):
+    """Serves a rendered image from memory, with its content hash as the ETag."""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        return "Image not found", 404
+
+    session_id = current_session()
+    search_dirs = [sessions.output_dir(session_id)] if session_id else []
+    if render_cache.cache_dir:
+        search_dirs.append(render_cache.cache_dir)
+    entry = image_store.get(digest, search_dirs)
+    if entry is None:
+        return "Image not found", 404
+
+    data, mimetype = entry
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(digest)
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Polling endpoint for queued render jobs."""
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_state(job))
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent event stream that reports job progress until it finishes."""
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    def stream():
+        last_state = None
+        while True:
+            job.wait(0.25)
+            state = job_state(job)
+            if state != last_state:
+                yield f"data: {json.dumps(state)}\n\n"
+                last_state = state
+            if job.done:
+                break
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint with stage timings, counters and resource gauges."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    """Starts, stops or reads the sampling profiler; only available with ENABLE_PROFILER=1."""
+    if not PROFILER_ENABLED:
+        abort(404)
+
+    if request.method == 'POST':
+        data = request.json or {}
+        if data.get('reset'):
+            profiler.reset()
+        if data.get('enabled'):
+            profiler.start(float(data['interval']) if data.get('interval') else None)
+        elif 'enabled' in data:
+            profiler.stop()
+    return jsonify(profiler.report(top=int(request.args.get('top', 50))))
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness probe; answers as soon as the app is imported."""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe with per-phase model load timings."""
+    status = models.status()
+    return jsonify(status), (200 if status['ready'] else 503)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,362 @@
+"""Benchmark the inversion and editing pipeline stage by stage.
+
+Runs on CPU with small stand-in encoder/generator modules, and additionally
+with the real checkpoints when they are present (--real). Results are
+printed or written as JSON so runs can be compared across commits:
+
+    python benchmark.py --batch-sizes 1 4 --resolutions 256 1024 --output bench.json
+
+A second suite drives the Flask routes through app.test_client() with the
+same stand-in models, so request handling, the render queue and the caches
+are measured too.
+"""
+import io
+import os
+import json
+import time
+import argparse
+import logging
+import platform
+import resource
+import subprocess
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+import inversion_utils
+from inversion_utils import (preprocess_image, encode_tensors, get_mean_latent, edit_latent_with_ganspace,
+                             synthesize, postprocess_images, image_to_bytes, configure_feature_cache, device)
+
+logger = logging.getLogger(__name__)
+
+NUM_WS = 18
+W_DIM = 512
+BENCH_ATTRIBUTES = {'smile': 4.0, 'age': -3.0, 'lighting': 6.0}
+
+
+class StandInBlock(nn.Module):
+    """Tiny synthesis block with the same call signature and bookkeeping as stylegan2-ada's SynthesisBlock"""
+
+    def __init__(self, resolution, in_channels, out_channels):
+        super().__init__()
+        self.resolution = resolution
+        self.is_first = in_channels == 0
+        self.num_conv = 1 if self.is_first else 2
+        self.num_torgb = 1
+        self.channels_last = False
+        self.use_fp16 = False
+        if self.is_first:
+            self.const = nn.Parameter(torch.randn(out_channels, 4, 4))
+        else:
+            self.conv0 = nn.Conv2d(in_channels, out_channels, 3, padding=1)
+        self.conv1 = nn.Conv2d(out_channels, out_channels, 3, padding=1)
+        self.affine = nn.Linear(W_DIM, out_channels)
+        self.torgb = nn.Conv2d(out_channels, 3, 1)
+
+    def forward(self, x, img, ws, noise_mode='random', force_fp32=False):
+        if self.is_first:
+            x = self.const.unsqueeze(0).repeat(ws.shape[0], 1, 1, 1)
+        else:
+            x = self.conv0(F.interpolate(x, scale_factor=2))
+        x = self.conv1(x * self.affine(ws[:, 0])[:, :, None, None])
+        if noise_mode == 'random':
+            x = x + torch.randn_like(x[:, :1]) * 0.1
+        x = F.leaky_relu(x, 0.2)
+        y = self.torgb(x)
+        img = y if img is None else F.interpolate(img, scale_factor=2) + y
+        return x, img
+
+
+class StandInSynthesis(nn.Module):
+    def __init__(self, img_resolution, channels=16):
+        super().__init__()
+        self.img_resolution = img_resolution
+        self.num_ws = NUM_WS
+        self.block_resolutions = [2 ** i for i in range(2, int(np.log2(img_resolution)) + 1)]
+        in_channels = 0
+        for res in self.block_resolutions:
+            setattr(self, f'b{res}', StandInBlock(res, in_channels, channels))
+            in_channels = channels
+
+    def forward(self, ws, noise_mode='random', force_fp32=False):
+        x = img = None
+        w_idx = 0
+        for res in self.block_resolutions:
+            block = getattr(self, f'b{res}')
+            x, img = block(x, img, ws.narrow(1, w_idx, block.num_conv + block.num_torgb),
+                           noise_mode=noise_mode, force_fp32=force_fp32)
+            w_idx += block.num_conv
+        return img
+
+
+class StandInMapping(nn.Module):
+    def __init__(self, z_dim=W_DIM):
+        super().__init__()
+        self.net = nn.Sequential(nn.Linear(z_dim, W_DIM), nn.LeakyReLU(0.2), nn.Linear(W_DIM, W_DIM))
+        self.register_buffer('w_avg', torch.zeros(W_DIM))
+
+    def forward(self, z, c, truncation_psi=1):
+        return self.net(z).unsqueeze(1).repeat(1, NUM_WS, 1)
+
+
+class StandInGenerator(nn.Module):
+    def __init__(self, img_resolution):
+        super().__init__()
+        self.z_dim = W_DIM
+        self.w_dim = W_DIM
+        self.img_resolution = img_resolution
+        self.mapping = StandInMapping()
+        self.synthesis = StandInSynthesis(img_resolution)
+
+
+class StandInEncoder(nn.Module):
+    """Maps a (N, 3, 256, 256) batch to (N, 18, 512) latents like HyperStyle with return_latents=True"""
+
+    def __init__(self):
+        super().__init__()
+        self.features = nn.Sequential(nn.Conv2d(3, 16, 4, stride=4), nn.ReLU(),
+                                      nn.Conv2d(16, 32, 4, stride=4), nn.ReLU(),
+                                      nn.AdaptiveAvgPool2d(1))
+        self.head = nn.Linear(32, NUM_WS * W_DIM)
+
+    def forward(self, x, return_latents=False):
+        latents = self.head(self.features(x).flatten(1)).view(-1, NUM_WS, W_DIM)
+        return (x, latents) if return_latents else x
+
+
+def use_stand_in_components():
+    """Random orthonormal components so GANSpace editing runs without the real PCA file"""
+    rng = np.random.RandomState(0)
+    q, _ = np.linalg.qr(rng.randn(NUM_WS * W_DIM, 80))
+    inversion_utils._ganspace_components = {'components': q.T.astype(np.float32), 'semantic_mappings': {}}
+    inversion_utils._edit_directions = None
+    inversion_utils._mean_latent_cache = None
+
+
+def peak_rss_mb():
+    """Peak RSS of the whole process so far; each run includes the peaks of the runs before it"""
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def summarize(samples):
+    samples_ms = np.array(samples) * 1000
+    return {
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'mean_ms': float(samples_ms.mean()),
+        'runs': len(samples),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def bench_pipeline(encoder, generator, batch_size, max_resolution, iterations, warmup):
+    """Time each stage of one upload-to-PNG pass for a batch of identical test photos"""
+    photo = Image.fromarray(np.random.RandomState(1).randint(0, 255, (512, 384, 3), dtype=np.uint8))
+    stages = {name: [] for name in ('align', 'encode', 'truncate', 'edit', 'synthesize',
+                                    'postprocess', 'png_encode', 'total')}
+
+    with torch.no_grad():
+        for i in range(warmup + iterations):
+            started = time.perf_counter()
+            img_tensor, t_align = timed(preprocess_image, photo)
+            batch = img_tensor.repeat(batch_size, 1, 1, 1)
+            latents, t_encode = timed(encode_tensors, batch, encoder)
+
+            def truncate(codes):
+                mean_latent = get_mean_latent(generator)
+                return mean_latent + 0.7 * (codes - mean_latent)
+            truncated, t_truncate = timed(truncate, latents)
+            edited, t_edit = timed(edit_latent_with_ganspace, truncated, BENCH_ATTRIBUTES)
+            raw, t_synth = timed(synthesize, generator, edited, 'const', max_resolution)
+            images, t_post = timed(postprocess_images, raw)
+            _, t_png = timed(lambda: [image_to_bytes(img) for img in images])
+            total = time.perf_counter() - started
+
+            if i >= warmup:
+                for name, value in zip(stages, (t_align, t_encode, t_truncate, t_edit, t_synth,
+                                                t_post, t_png, total)):
+                    stages[name].append(value)
+
+    summary = {name: summarize(samples) for name, samples in stages.items()}
+    summary['throughput_images_per_sec'] = batch_size / float(np.mean(stages['total']))
+    return summary
+
+
+def run_suite(label, load_models, batch_sizes, resolutions, iterations, warmup):
+    (encoder, generator), load_seconds = timed(load_models)
+    generator.eval()
+    encoder.eval()
+    get_mean_latent(generator)
+
+    results = []
+    for resolution in resolutions:
+        if resolution > generator.img_resolution:
+            continue
+        for batch_size in batch_sizes:
+            logger.info(f"[{label}] batch_size={batch_size} resolution={resolution}")
+            result = bench_pipeline(encoder, generator, batch_size, resolution, iterations, warmup)
+            result.update(batch_size=batch_size, resolution=resolution, cumulative_peak_rss_mb=peak_rss_mb())
+            results.append(result)
+    return {'models': label, 'load_seconds': load_seconds, 'runs': results}
+
+
+def test_photo(seed):
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.RandomState(seed).randint(0, 255, (512, 384, 3), dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def stand_in_client(resolution=256):
+    """The app module and a test client for it, serving with stand-in models.
+
+    Outputs are not persisted and the latent library lives in a temporary
+    directory unless the environment already says otherwise.
+    """
+    os.environ['DEFER_MODEL_LOADING'] = '1'
+    os.environ.setdefault('PERSIST_OUTPUTS', '0')
+    os.environ.setdefault('PRECOMPUTE_SWEEPS', '0')
+    os.environ.setdefault('LATENT_LIBRARY_DIR', tempfile.mkdtemp(prefix='bench-library-'))
+    import app as app_module
+    from model_registry import ModelRegistry
+
+    inversion_utils._mean_latent_cache = None
+    app_module.models = ModelRegistry([
+        ('encoder', lambda models: StandInEncoder().to(device).eval()),
+        ('generator', lambda models: StandInGenerator(resolution).to(device).eval()),
+        ('mean_latent', lambda models: get_mean_latent(models['generator'])),
+        ('inference_mode', lambda models: inversion_utils.configure_inference(models['generator'])),
+    ])
+    app_module.models.load()
+    if app_module.models.error:
+        raise RuntimeError(f"Stand-in models failed to load: {app_module.models.error}")
+    return app_module, app_module.app.test_client()
+
+
+def bench_routes(iterations, warmup, resolution=256):
+    """Time the Flask routes end to end with app.test_client() and stand-in models.
+
+    Every upload is a new photo and every /customize run a new slider value,
+    so both miss the latent and render caches; customize_cached repeats one
+    edit set to measure the render cache hit path.
+    """
+    app_module, client = stand_in_client(resolution)
+
+    def check(response):
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.request.path} returned {response.status_code}")
+        return response
+
+    def customized_image_url():
+        with app_module.app.test_request_context():
+            return app_module.session_image_url(client.get_cookie(app_module.SESSION_COOKIE).value, 'customized')
+
+    def finish(response):
+        job = app_module.render_queue.get(check(response).get_json()['job_id'])
+        if not job.wait(app_module.RENDER_TIMEOUT) or job.error:
+            raise RuntimeError(f"{response.request.path} job failed: {job.error}")
+        return job
+
+    routes = {
+        'upload': lambda i: check(client.post('/', data={'file': (io.BytesIO(test_photo(i)), 'photo.png')},
+                                              content_type='multipart/form-data')),
+        'customize': lambda i: finish(client.post('/customize', json={'smile': 0.5 + i})),
+        'customize_cached': lambda i: finish(client.post('/customize', json={'smile': 0.5})),
+        'preview': lambda i: check(client.post('/customize/preview', json={'age': -0.5 - i})),
+        'generate': lambda i: finish(client.post('/generate', json={'seeds': [i]})),
+        'image': lambda i: check(client.get(customized_image_url())),
+    }
+    samples = {name: [] for name in routes}
+    for i in range(warmup + iterations):
+        for name, route in routes.items():
+            _, seconds = timed(route, i)
+            if i >= warmup:
+                samples[name].append(seconds)
+
+    results = {name: summarize(values) for name, values in samples.items()}
+    return {'models': 'stand-in', 'resolution': resolution, 'routes': results,
+            'cumulative_peak_rss_mb': peak_rss_mb()}
+
+
+def real_checkpoints_available(encoder_path, generator_path):
+    # Git LFS pointers are tiny text files; only treat real weights as present
+    return all(os.path.exists(p) and os.path.getsize(p) > 1024 * 1024 for p in (encoder_path, generator_path))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inversion and editing pipeline")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[128, 256, 1024],
+                        help="Synthesis output resolutions (lower ones stop synthesis early)")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--real', action='store_true', help="Also benchmark the real checkpoints if present")
+    parser.add_argument('--encoder-path', default='models/hyperstyle/hyperstyle_ffhq.pt')
+    parser.add_argument('--generator-path', default='models/stylegan2-ada-pytorch/ffhq.pkl')
+    parser.add_argument('--feature-cache', action='store_true',
+                        help="Keep the synthesis block cache on (repeated identical inputs will hit it)")
+    parser.add_argument('--no-routes', action='store_true', help="Skip the Flask route suite")
+    parser.add_argument('--output', help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    torch.manual_seed(0)
+    if not args.feature_cache:
+        configure_feature_cache(0)
+
+    report = {
+        'revision': git_revision(),
+        'device': device,
+        'torch': torch.__version__,
+        'threads': torch.get_num_threads(),
+        'suites': [],
+    }
+
+    use_stand_in_components()
+    report['suites'].append(run_suite(
+        'stand-in', lambda: (StandInEncoder().to(device), StandInGenerator(max(args.resolutions)).to(device)),
+        args.batch_sizes, args.resolutions, args.iterations, args.warmup))
+
+    if not args.no_routes:
+        report['routes'] = bench_routes(args.iterations, args.warmup)
+
+    if args.real:
+        if real_checkpoints_available(args.encoder_path, args.generator_path):
+            inversion_utils._ganspace_components = None
+            inversion_utils._edit_directions = None
+            inversion_utils._mean_latent_cache = None
+            report['suites'].append(run_suite(
+                'real', lambda: (inversion_utils.load_hyperstyle_model(args.encoder_path),
+                                 inversion_utils.load_stylegan2_generator(args.generator_path)),
+                args.batch_sizes, args.resolutions, args.iterations, args.warmup))
+        else:
+            logger.warning("Real checkpoints not found, skipping the real-model suite")
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info(f"Wrote benchmark results to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
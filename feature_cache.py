@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def block_prefix_keys(ws_rows, block_ends, salt=''):
+    """Cache keys for every synthesis block output of every sample.
+
+    A block's output depends only on the W+ rows up to the last one it
+    consumes, so its key is a running hash of those rows. ws_rows is a
+    (N, num_ws, w_dim) float32 NumPy array; block_ends[i] is one past the
+    last row block i reads. Returns an N x len(block_ends) list of keys.
+    """
+    keys = []
+    for row in ws_rows:
+        digest = hashlib.sha1(salt.encode('utf-8'))
+        row_keys = []
+        start = 0
+        for end in block_ends:
+            digest.update(row[start:end].tobytes())
+            start = end
+            row_keys.append(digest.copy().hexdigest())
+        keys.append(row_keys)
+    return keys
+
+
+class FeatureCache:
+    """Byte-bounded LRU of per-sample synthesis block outputs.
+
+    Each entry holds the (x, img) tensors one block produced for one
+    sample, so a later render that only changes finer W+ layers can resume
+    synthesis after the last block it shares with an earlier render. Only
+    blocks up to max_resolution are kept, since the feature maps of the
+    largest blocks cost more memory than they save in compute.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_resolution=256):
+        self.max_bytes = max_bytes
+        self.max_resolution = max_resolution
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _nbytes(tensors):
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, x, img):
+        size = self._nbytes((x, img))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (x, img)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,202 @@
+"""Offline batch generation of edited synthetic faces.
+
+Example:
+    python generate_dataset.py photos/ --edits products.json --output-dir dataset/
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing
+
+import numpy as np
+import torch
+from PIL import Image
+
+import inversion_utils
+from inversion_utils import (load_hyperstyle_model, load_stylegan2_generator, init_mean_latent,
+                             check_ganspace_components, get_crop_box, crop_to_tensor, align_images,
+                             encode_tensors, render_variations, device)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+PROGRESS_FILE = 'progress.jsonl'
+
+
+def list_inputs(source):
+    """Input photos from a directory, a text manifest (one path per line) or a JSON list"""
+    if os.path.isdir(source):
+        return sorted(os.path.join(dirpath, name)
+                      for dirpath, _, filenames in os.walk(source)
+                      for name in filenames if name.lower().endswith(IMAGE_EXTENSIONS))
+    with open(source, 'r') as f:
+        if source.endswith('.json'):
+            return list(json.load(f))
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def load_edit_grid(path):
+    """Named edit sets from products.json, scenes.json, or a plain {name: edits} / [edits] file"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    if isinstance(data, list):
+        return [(f"edit{i}", edits) for i, edits in enumerate(data)]
+
+    grid = []
+    for name, entry in data.items():
+        if isinstance(entry, dict) and 'variations' in entry:
+            for i, variation in enumerate(entry['variations']):
+                if variation['edits'] != 'input':
+                    grid.append((f"{name}_var{i}", variation['edits']))
+        elif isinstance(entry, dict) and isinstance(entry.get('edits'), dict):
+            grid.append((name, entry['edits']))
+        else:
+            grid.append((name, entry))
+    return grid
+
+
+def init_worker():
+    """Pool initializer: keep each worker's face detector on the CPU with a single torch thread"""
+    inversion_utils.device = 'cpu'
+    torch.set_num_threads(1)
+
+
+def load_aligned(img_path):
+    """Pool worker: open and align one photo, returning a CPU array or None when unreadable"""
+    try:
+        img = Image.open(img_path).convert('RGB')
+        return img_path, crop_to_tensor(img, get_crop_box(img)).numpy()
+    except Exception as e:
+        logger.error(f"Skipping {img_path}: {e}")
+        return img_path, None
+
+
+def align_batch(img_paths):
+    """Align a batch in this process with one shared detector and one landmarks call per image size"""
+    readable = []
+    for img_path in img_paths:
+        try:
+            with Image.open(img_path) as img:
+                img.verify()
+            readable.append(img_path)
+        except Exception as e:
+            logger.error(f"Skipping {img_path}: {e}")
+    return readable, (align_images(readable) if readable else None)
+
+
+def aligned_batches(todo, args, pool=None):
+    """Yield (paths, (N, 3, 256, 256) device tensor) encoder batches using the chosen alignment mode"""
+    if pool is None:
+        for img_paths in batched(todo, args.encode_batch):
+            readable, img_tensors = align_batch(img_paths)
+            if readable:
+                yield readable, img_tensors
+        return
+
+    for batch in batched(pool.imap(load_aligned, todo, chunksize=4), args.encode_batch):
+        batch = [(path, array) for path, array in batch if array is not None]
+        if batch:
+            yield [path for path, _ in batch], torch.from_numpy(np.stack([array for _, array in batch])).to(device)
+
+
+def read_progress(output_dir):
+    path = os.path.join(output_dir, PROGRESS_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return {json.loads(line)['input'] for line in f if line.strip()}
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def output_name(img_path):
+    """Stable per-input folder name, so resumed runs write to the same place"""
+    stem = os.path.splitext(os.path.basename(img_path))[0]
+    return f"{stem}_{hashlib.sha1(os.path.abspath(img_path).encode('utf-8')).hexdigest()[:8]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate edited synthetic faces in bulk")
+    parser.add_argument('inputs', help="Directory of photos, or a .txt/.json manifest of paths")
+    parser.add_argument('--edits', required=True, help="products.json, scenes.json or a JSON edit grid")
+    parser.add_argument('--output-dir', default='dataset')
+    parser.add_argument('--format', default='png', choices=['png', 'jpg', 'webp'])
+    parser.add_argument('--size', type=int, default=None, help="Output resolution (default: generator resolution)")
+    parser.add_argument('--encode-batch', type=int, default=8, help="Faces per encoder batch")
+    parser.add_argument('--synthesis-batch', type=int, default=None, help="Images per synthesis batch")
+    parser.add_argument('--align', choices=['batched', 'workers'],
+                        default='batched' if device == 'cuda' else 'workers',
+                        help="Detect faces in batches in this process (default on GPU) or in a CPU worker pool")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Processes for loading and face alignment with --align workers")
+    parser.add_argument('--encoder-path', default='models/hyperstyle/hyperstyle_ffhq.pt')
+    parser.add_argument('--generator-path', default='models/stylegan2-ada-pytorch/ffhq.pkl')
+    parser.add_argument('--no-resume', action='store_true', help="Ignore progress from a previous run")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    inputs = list_inputs(args.inputs)
+    edit_grid = load_edit_grid(args.edits)
+    done = set() if args.no_resume else read_progress(args.output_dir)
+    todo = [path for path in inputs if path not in done]
+    logger.info(f"{len(inputs)} inputs x {len(edit_grid)} edits; {len(todo)} inputs left to process")
+    if not todo:
+        return
+
+    check_ganspace_components('models/ganspace')
+    encoder = load_hyperstyle_model(args.encoder_path)
+    generator = load_stylegan2_generator(args.generator_path)
+    init_mean_latent(generator, args.generator_path)
+
+    edit_names = [name for name, _ in edit_grid]
+    edits_list = [edits for _, edits in edit_grid]
+    started = time.perf_counter()
+    rendered = 0
+
+    # Every worker builds its own detector, so each runs on one CPU thread instead of
+    # opening a CUDA context (and a detector copy) on the GPU or oversubscribing cores
+    pool = (multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_worker)
+            if args.align == 'workers' else None)
+    try:
+        with open(os.path.join(args.output_dir, PROGRESS_FILE), 'a') as progress:
+            for img_paths, img_tensors in aligned_batches(todo, args, pool):
+                latents = encode_tensors(img_tensors, encoder)
+
+                for img_path, latent in zip(img_paths, latents):
+                    face_dir = os.path.join(args.output_dir, output_name(img_path))
+                    os.makedirs(face_dir, exist_ok=True)
+                    output_paths = [os.path.join(face_dir, f"{name}.{args.format}") for name in edit_names]
+                    render_variations(latent.unsqueeze(0), generator, edits_list, output_paths,
+                                      batch_size=args.synthesis_batch, size=args.size)
+                    rendered += len(edits_list)
+
+                    progress.write(json.dumps({'input': img_path, 'output': face_dir}) + '\n')
+                    progress.flush()
+
+                elapsed = time.perf_counter() - started
+                logger.info(f"Rendered {rendered} images in {elapsed:.1f}s ({rendered / elapsed:.2f} images/sec)")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Finished: {rendered} images in {elapsed:.1f}s ({rendered / max(elapsed, 1e-9):.2f} images/sec)")
+
+
+if __name__ == '__main__':
+    main()
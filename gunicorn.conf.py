@@ -0,0 +1,10 @@
+import os
+
+# No preload_app: the worker imports the app after fork and loads the models in a
+# background thread, so the port binds immediately, /readyz reports load progress,
+# and no torch work runs in the master before forking.
+
+# Render jobs and their status live in-process, so keep a single worker and scale with threads
+workers = 1
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 300
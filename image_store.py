@@ -0,0 +1,75 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE_EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp'}
+
+
+class ImageStore:
+    """Content-addressed, size-bounded in-memory store of encoded images.
+
+    Images are keyed by the SHA-256 of their bytes, which doubles as the
+    HTTP ETag. put() can optionally also persist the bytes to a directory so
+    they survive eviction and restarts.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._entries
+
+    @staticmethod
+    def filename(digest, mimetype):
+        return f"{digest}.{MIMETYPE_EXTENSIONS.get(mimetype, 'bin')}"
+
+    def put(self, data, mimetype='image/png', persist_dir=None):
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+            else:
+                self._entries[digest] = (data, mimetype)
+                self._size += len(data)
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    _, (evicted, _) = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+
+        if persist_dir:
+            path = os.path.join(persist_dir, self.filename(digest, mimetype))
+            if not os.path.exists(path):
+                os.makedirs(persist_dir, exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+        return digest
+
+    def get(self, digest, search_dirs=()):
+        """Look an image up in memory, falling back to persisted copies in search_dirs"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                return entry
+
+        for folder in search_dirs:
+            for mimetype in MIMETYPE_EXTENSIONS:
+                path = os.path.join(folder, self.filename(digest, mimetype))
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        return f.read(), mimetype
+        return None
@@ -1,42 +1,53 @@
+import io
 import os
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as transforms
 from torchvision.utils import save_image
-from PIL import Image, ImageEnhance
+from PIL import Image, ImageDraw, ImageFilter
 from argparse import Namespace
 import logging
 import numpy as np
 import pickle
 import json
+import hashlib
+from collections import OrderedDict
+
+from latent_cache import LatentCache, make_cache_key
+from feature_cache import FeatureCache, block_prefix_keys
+from metrics import registry as metrics, stage_timer
+from model_manifest import add_source_paths, verify_artifact, file_sha256
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-import sys
-for repo_path in ['hyperstyle', 'stylegan2-ada-pytorch']:
-    if not os.path.exists(repo_path):
-        logger.warning(f"Repository {repo_path} not found. Attempting to clone...")
-        if repo_path == 'hyperstyle':
-            os.system("git clone https://github.com/yuval-alaluf/hyperstyle.git")
-        elif repo_path == 'stylegan2-ada-pytorch':
-            os.system("git clone https://github.com/NVlabs/stylegan2-ada-pytorch.git")
-    sys.path.append(os.path.abspath(repo_path))
-
-try:
-    from hyperstyle.models.hyperstyle import HyperStyle
-    import dnnlib
-    import legacy
-except ImportError as e:
-    logger.error(f"Failed to import required modules: {e}")
-    raise
-
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 logger.info(f"Using device: {device}")
 
 _mean_latent_cache = None
+_inference = {'mode': 'fp32', 'batch_size': 1, 'compiled': None, 'compiled_noise': None, 'traced': {}, 'block_flags': {}}
+_edit_directions = None
+_face_detector = None
+_crop_box_cache = OrderedDict()
 _ganspace_components = None
+_latent_cache = None
+_feature_cache = None
+_noise_buffer_index = {}
+# Checksums of the loaded checkpoints and mean latent, folded into render cache keys
+_render_identity = {}
+
+# W+ layers in the FFHQ 1024x1024 generator
+NUM_WS = 18
 
 def load_hyperstyle_model(model_path):
+    add_source_paths()
+    verify_artifact(model_path)
+    try:
+        from hyperstyle.models.hyperstyle import HyperStyle
+    except ImportError as e:
+        logger.error(f"Failed to import required modules: {e}")
+        raise
+    
     logger.info(f"Loading HyperStyle model from {model_path}")
     ckpt = torch.load(model_path, map_location=device)
     opts = ckpt['opts']
@@ -50,115 +61,136 @@ def load_hyperstyle_model(model_path):
     encoder = HyperStyle(opts)
     encoder.eval()
     encoder.to(device)
+    _render_identity['encoder'] = file_checksum(model_path)
     logger.info("HyperStyle model loaded successfully")
     return encoder
 
 def load_stylegan2_generator(model_path):
+    add_source_paths()
+    verify_artifact(model_path)
+    try:
+        import dnnlib
+        import legacy
+    except ImportError as e:
+        logger.error(f"Failed to import required modules: {e}")
+        raise
+    
     logger.info(f"Loading generator from {model_path}")
     with dnnlib.util.open_url(model_path) as f:
         G = legacy.load_network_pkl(f)['G_ema'].to(device)
+    _render_identity['generator'] = file_checksum(model_path)
     logger.info("Generator loaded successfully")
     return G
 
-def get_mean_latent(generator, samples=10000):
+def file_checksum(path):
+    """SHA-256 of a file, cached next to it until the file changes"""
+    return file_sha256(path)
+
+def mean_latent_path(model_path):
+    """Location of the persisted W-space mean, tied to the generator pickle's checksum"""
+    base, _ = os.path.splitext(model_path)
+    return f"{base}.mean_latent.{file_checksum(model_path)[:16]}.npy"
+
+def compute_mean_latent(generator, samples=10000, chunk_size=1000):
+    """Average generator.mapping over random z in fixed-size chunks to bound memory"""
+    logger.info("Computing mean latent vector...")
+    total = None
+    with torch.no_grad():
+        for start in range(0, samples, chunk_size):
+            n = min(chunk_size, samples - start)
+            z = torch.randn(n, generator.z_dim, device=device)
+            w_sum = generator.mapping(z, None).sum(0, keepdim=True)
+            total = w_sum if total is None else total + w_sum
+    logger.info("Mean latent computed")
+    return total / samples
+
+def _use_mean_latent(mean_latent, source):
     global _mean_latent_cache
-    if _mean_latent_cache is None:
-        logger.info("Computing mean latent vector...")
-        z = torch.randn(samples, generator.z_dim, device=device)
-        with torch.no_grad():
-            w = generator.mapping(z, None)
-            _mean_latent_cache = w.mean(0, keepdim=True)
-        logger.info("Mean latent computed")
-    return _mean_latent_cache
+    _mean_latent_cache = mean_latent
+    _render_identity['mean_latent'] = {
+        'source': source,
+        'sha256': hashlib.sha256(mean_latent.detach().cpu().numpy().tobytes()).hexdigest(),
+    }
+    return mean_latent
 
-def download_ganspace_components(components_path='models/ganspace'):
-    """Download GANSpace principal components for FFHQ StyleGAN2"""
-    logger.info(f"Setting up GANSpace components at {components_path}")
-    
-    os.makedirs(components_path, exist_ok=True)
-    
-    components_file = os.path.join(components_path, 'ffhq_pca_components.pkl')
-    
-    if not os.path.exists(components_file):
-        logger.info("Downloading GANSpace components...")
-        components_url = "https://github.com/harskish/ganspace/releases/download/v1.0/ffhq_pca_components.pkl"
-        
-        try:
-            os.system(f"wget {components_url} -O {components_file}")
-            
-            if os.path.exists(components_file) and os.path.getsize(components_file) > 1000:
-                logger.info("Downloaded GANSpace components successfully")
-            else:
-                logger.warning("Download failed or file is too small. Creating synthetic components...")
-                create_synthetic_components(components_file)
-        except Exception as e:
-            logger.error(f"Failed to download GANSpace components: {e}")
-            logger.info("Creating synthetic components...")
-            create_synthetic_components(components_file)
-    else:
-        logger.info(f"GANSpace components already exist at {components_file}")
+def init_mean_latent(generator, model_path, source='sampled'):
+    """Load the truncation mean at startup.
 
-def create_synthetic_components(components_file):
-    """Create synthetic PCA components if download fails"""
-    logger.info("Creating synthetic GANSpace components...")
-    
-    
-    np.random.seed(42)  
+    source='w_avg' uses the generator's tracked w_avg buffer. Otherwise the
+    sampled mean is read from disk next to the pickle, or computed and saved
+    there when missing.
+    """
+    if source == 'w_avg' and hasattr(generator.mapping, 'w_avg'):
+        logger.info("Using generator w_avg as the mean latent")
+        return _use_mean_latent(generator.mapping.w_avg.detach().view(1, 1, -1).to(device), 'w_avg')
     
-    n_layers = 18
-    latent_dim = 512
-    n_components = 80   
+    cache_path = mean_latent_path(model_path)
+    if os.path.exists(cache_path):
+        logger.info(f"Loaded mean latent from {cache_path}")
+        return _use_mean_latent(torch.from_numpy(np.load(cache_path)).to(device), 'sampled')
     
-    components = np.random.randn(n_components, n_layers * latent_dim)
-    
-    Q, R = np.linalg.qr(components.T)
-    components = Q.T[:n_components]
+    mean_latent = _use_mean_latent(compute_mean_latent(generator), 'sampled')
+    try:
+        np.save(cache_path, mean_latent.cpu().numpy())
+        logger.info(f"Saved mean latent to {cache_path}")
+    except OSError as e:
+        logger.warning(f"Could not persist mean latent to {cache_path}: {e}")
+    return mean_latent
+
+def get_mean_latent(generator, samples=10000):
+    if _mean_latent_cache is None:
+        return _use_mean_latent(compute_mean_latent(generator, samples), 'sampled')
+    return _mean_latent_cache
+
+def check_ganspace_components(components_path='models/ganspace'):
+    """Verify the GANSpace principal components against the model manifest; never downloads"""
+    return verify_artifact(os.path.join(components_path, 'ffhq_pca_components.pkl'))
+
+def convert_ganspace_components(components_path='models/ganspace'):
+    """Convert the pickled components once into a raw .npy that can be memory-mapped"""
+    components_file = os.path.join(components_path, 'ffhq_pca_components.pkl')
+    npy_file = os.path.join(components_path, 'ffhq_pca_components.npy')
+    mappings_file = os.path.join(components_path, 'ffhq_pca_semantic_mappings.json')
     
-    for i in range(n_components):
-        components[i] = components[i] / np.linalg.norm(components[i])
+    source_mtime = os.path.getmtime(components_file)
+    if all(os.path.exists(path) and os.path.getmtime(path) >= source_mtime for path in (npy_file, mappings_file)):
+        return npy_file, mappings_file
     
-    component_data = {
-        'components': components,
-        'mean': np.zeros(n_layers * latent_dim),
-        'stdev': np.ones(n_components),
-        'comp_indices': list(range(n_components))
-    }
+    logger.info(f"Converting {components_file} to memory-mappable {npy_file}")
+    with open(components_file, 'rb') as f:
+        data = pickle.load(f)
     
-    with open(components_file, 'wb') as f:
-        pickle.dump(component_data, f)
+    if isinstance(data, dict):
+        components = data['components']
+        semantic_mappings = data.get('semantic_mappings', {})
+    else:
+        components = data
+        semantic_mappings = {}
     
-    logger.info(f"Created synthetic GANSpace components with {n_components} components")
+    # Per-process temp names, since the app and dataset workers may convert at the same time;
+    # the mappings land first so a fresh .npy always has its mappings next to it
+    suffix = f".{os.getpid()}.tmp"
+    with open(mappings_file + suffix, 'w') as f:
+        json.dump(semantic_mappings, f)
+    os.replace(mappings_file + suffix, mappings_file)
+    with open(npy_file + suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(components, dtype=np.float32))
+    os.replace(npy_file + suffix, npy_file)
+    return npy_file, mappings_file
 
 def load_ganspace_components(components_path='models/ganspace'):
-    """Load GANSpace principal components"""
+    """Load GANSpace principal components as a read-only memory map shared across processes"""
     logger.info(f"Loading GANSpace components from {components_path}")
     
-    download_ganspace_components(components_path)
+    check_ganspace_components(components_path)
+    npy_file, mappings_file = convert_ganspace_components(components_path)
     
-    components_file = os.path.join(components_path, 'ffhq_pca_components.pkl')
+    components = np.load(npy_file, mmap_mode='r')
+    with open(mappings_file, 'r') as f:
+        semantic_mappings = json.load(f)
     
-    try:
-        with open(components_file, 'rb') as f:
-            data = pickle.load(f)
-        
-        if isinstance(data, dict):
-            components = data['components']
-            semantic_mappings = data.get('semantic_mappings', {})
-        else:
-            components = data
-            semantic_mappings = {}
-        
-        logger.info(f"Loaded GANSpace components with shape: {components.shape}")
-        return torch.from_numpy(components).float().to(device), semantic_mappings
-        
-    except Exception as e:
-        logger.error(f"Error loading GANSpace components: {e}")
-        create_synthetic_components(components_file)
-        with open(components_file, 'rb') as f:
-            data = pickle.load(f)
-        components = data['components']
-        semantic_mappings = data['semantic_mappings']
-        return torch.from_numpy(components).float().to(device), semantic_mappings
+    logger.info(f"Loaded GANSpace components with shape: {components.shape}")
+    return components, semantic_mappings
 
 def get_ganspace_components():
     """Get cached GANSpace components"""
@@ -171,112 +203,194 @@ def get_ganspace_components():
         }
     return _ganspace_components
 
+def get_component_rows(indices):
+    """Copy only the requested principal components out of the memory map onto the device"""
+    components = get_ganspace_components()['components']
+    rows = np.array(components[list(indices)], dtype=np.float32)
+    return torch.from_numpy(rows).to(device)
+
+def build_edit_directions(semantic_mappings, components):
+    """Fold each attribute's component, direction, base strength and importance weight into one row.
+
+    A mapping may restrict its edit to a range of W+ layers with
+    "layers": [start, end], as in GANSpace; the row is zero outside it.
+    """
+    names = []
+    indices = []
+    scales = []
+    layer_ranges = []
+    for attr_name, mapping in semantic_mappings.items():
+        component_idx = mapping['component']
+        if component_idx >= components.shape[0]:
+            logger.warning(f"Component index {component_idx} out of range for {attr_name}")
+            continue
+        
+        importance_weight = 1.0 / (1.0 + 0.05 * component_idx)
+        names.append(attr_name)
+        indices.append(component_idx)
+        scales.append(mapping['direction'] * mapping['strength'] * importance_weight)
+        layer_ranges.append(mapping.get('layers', (0, NUM_WS)))
+    
+    if indices:
+        matrix = get_component_rows(indices) * torch.tensor(scales, device=device).view(-1, 1)
+        layer_mask = torch.zeros(len(indices), NUM_WS, 1, device=device)
+        for row, (start, end) in enumerate(layer_ranges):
+            layer_mask[row, start:end] = 1.0
+        matrix = (matrix.view(len(indices), NUM_WS, -1) * layer_mask).view(len(indices), -1)
+    else:
+        matrix = torch.zeros(0, components.shape[1], device=device)
+    return {
+        'names': names,
+        'index': {name: i for i, name in enumerate(names)},
+        'matrix': matrix
+    }
+
+def reload_edit_directions(config_path='config.json'):
+    """Re-read config.json and rebuild the GANSpace direction matrix"""
+    global _edit_directions
+    with open(config_path, 'r') as f:
+        semantic_mappings = json.load(f)
+    
+    directions = build_edit_directions(semantic_mappings, get_ganspace_components()['components'])
+    directions['config_path'] = config_path
+    directions['config_mtime'] = os.path.getmtime(config_path)
+    _edit_directions = directions
+    logger.info(f"Built GANSpace direction matrix for {len(directions['names'])} attributes")
+    return directions
+
+def get_edit_directions(config_path='config.json'):
+    """Get the cached direction matrix, rebuilding it when config.json has changed on disk"""
+    directions = _edit_directions
+    if (directions is None or directions['config_path'] != config_path
+            or os.path.getmtime(config_path) != directions['config_mtime']):
+        directions = reload_edit_directions(config_path)
+    return directions
+
+def attribute_strengths(attributes, directions):
+    """Turn a dict of slider values into a strength vector aligned with the direction matrix rows"""
+    strengths = [0.0] * len(directions['names'])
+    for attr_name, strength in attributes.items():
+        if attr_name not in directions['index'] or abs(strength) <= 0.001:
+            continue
+        
+        if attr_name == 'serious_mood' and strength < 0:
+            logger.warning(f"Ignoring negative value for {attr_name}: {strength}")
+            continue
+        
+        if attr_name == 'eye_color' and strength > 0:
+            logger.warning(f"Ignoring positive value for {attr_name}: {strength}")
+            continue
+        
+        effective_strength = strength * 0.8
+        if abs(strength) > 5.0:
+            boost_factor = 1.0 + (abs(strength) - 5.0) * 0.3
+            effective_strength *= boost_factor
+        strengths[directions['index'][attr_name]] = effective_strength
+    return strengths
+
 def edit_latent_with_ganspace(latent_codes, attributes):
-    """Edit latent codes using GANSpace principal components"""
-    if not attributes or all(abs(v) < 0.001 for v in attributes.values()):
+    """Edit latent codes using GANSpace principal components.
+
+    attributes is either one dict applied to every latent in the batch, or a
+    list with one dict per latent.
+    """
+    per_row = isinstance(attributes, (list, tuple))
+    attribute_sets = attributes if per_row else [attributes]
+    if all(not attrs or all(abs(v) < 0.001 for v in attrs.values()) for attrs in attribute_sets):
         return latent_codes
     
-    ganspace_data = get_ganspace_components()
-    components = ganspace_data['components']
-    
-    with open('config.json', 'r') as f:
-        semantic_mappings = json.load(f)
+    directions = get_edit_directions()
+    matrix = directions['matrix']
     
     batch_size = latent_codes.shape[0]
     num_layers = latent_codes.shape[1]
     
-    flattened_latents = latent_codes.view(batch_size, -1)
-    edited_latents = flattened_latents.clone()
-    
-    logger.info(f"Editing with GANSpace - attributes: {attributes}")
+    logger.debug(f"Editing with GANSpace - attributes: {attributes}")
     
-    for attr_name, strength in attributes.items():
-        if attr_name in semantic_mappings and abs(strength) > 0.001:
-            
-            if attr_name == 'serious_mood' and strength < 0:
-                logger.warning(f"Ignoring negative value for {attr_name}: {strength}")
-                continue
-            
-            if attr_name == 'eye_color' and strength > 0:
-                logger.warning(f"Ignoring positive value for {attr_name}: {strength}")
-                continue
-        
-            mapping = semantic_mappings[attr_name]
-            component_idx = mapping['component']
-            direction = mapping['direction']
-            base_strength = mapping['strength']
-            
-            if component_idx < components.shape[0]:
-                component = components[component_idx]
-                
-                effective_strength = strength * direction * base_strength * 0.8  
-                
-                importance_weight = 1.0 / (1.0 + 0.05 * component_idx)  
-                effective_strength *= importance_weight
-                
-                if abs(strength) > 5.0:
-                    boost_factor = 1.0 + (abs(strength) - 5.0) * 0.3
-                    effective_strength *= boost_factor
-                
-                logger.info(f"Applying GANSpace edit for {attr_name}: "
-                            f"component {component_idx}, strength {effective_strength:.3f}")
-                
-                for i in range(batch_size):
-                    edited_latents[i] = edited_latents[i] + component * effective_strength
-            else:
-                logger.warning(f"Component index {component_idx} out of range for {attr_name}")
+    strengths = torch.tensor([attribute_strengths(attrs, directions) for attrs in attribute_sets],
+                             dtype=matrix.dtype, device=matrix.device)
+    offsets = (strengths @ matrix).to(latent_codes.dtype)
     
-    edited_latent_codes = edited_latents.view(batch_size, num_layers, -1)
+    edited_latents = latent_codes.reshape(batch_size, -1) + offsets
     
-    return edited_latent_codes
+    return edited_latents.view(batch_size, num_layers, -1)
 
-def process_image(img_path, encoder, generator, output_path, truncation=0.7, noise_strength=0.05, 
-                  gender=0.0, smile=0.0, pose=0.0, age=0.0, lighting=0.0, hair_color=0.0, 
-                  hair_length=0.0, expression=0.0, eye_color=0.0, eye_state=0.0, 
-                  serious_mood=0.0, maturity=0.0):
-    logger.info(f"Processing image with HyperStyle + GANSpace - truncation={truncation}, noise_strength={noise_strength}")
-    logger.info(f"Attribute editing: gender={gender}, smile={smile}, pose={pose}, age={age}")
-    logger.info(f"Additional attributes: lighting={lighting}, hair_color={hair_color}, hair_length={hair_length}, expression={expression}, eye_color={eye_color}, eye_state={eye_state}, serious_mood={serious_mood}, maturity={maturity}")
+PREPROCESS_SETTINGS = {'aligner': 'face_alignment', 'crop_scale': 1.5, 'input_size': 256}
+# Precision the HyperStyle encoder runs in, whatever INFERENCE_MODE synthesis uses
+ENCODER_MODE = 'fp32'
+MAX_CACHED_CROP_BOXES = 256
+
+def get_face_detector():
+    """Get the shared face_alignment detector, or None when the module is not installed"""
+    global _face_detector
+    if _face_detector is None:
+        try:
+            import face_alignment
+        except ImportError:
+            logger.info("Face alignment module not available, using center crop")
+            _face_detector = False
+        else:
+            logger.info("Loading face_alignment detector...")
+            _face_detector = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, device=device)
+    return _face_detector or None
+
+def center_crop_box(width, height):
+    size = min(width, height)
+    left = (width - size) // 2
+    top = (height - size) // 2
+    return (left, top, left + size, top + size)
+
+def landmarks_crop_box(landmarks, width, height):
+    """Square-ish crop around one face's landmarks, enlarged by crop_scale"""
+    left = np.min(landmarks[:, 0])
+    top = np.min(landmarks[:, 1])
+    right = np.max(landmarks[:, 0])
+    bottom = np.max(landmarks[:, 1])
     
-    img = Image.open(img_path).convert('RGB')
+    face_width, face_height = right - left, bottom - top
+    center_x, center_y = (left + right) // 2, (top + bottom) // 2
+    size = int(max(face_width, face_height) * PREPROCESS_SETTINGS['crop_scale'])
+    left = max(0, center_x - size // 2)
+    top = max(0, center_y - size // 2)
+    right = min(width, center_x + size // 2)
+    bottom = min(height, center_y + size // 2)
+    return (float(left), float(top), float(right), float(bottom))
+
+def detect_crop_boxes(img):
+    """Run face detection on a PIL image and return a crop box per face, in detection order"""
+    fa = get_face_detector()
+    if fa is None:
+        return [center_crop_box(*img.size)]
     
-    # Face detection and cropping 
-    try:
-        import face_alignment
-        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, device=device)
+    with stage_timer('detect'):
         detected_faces = fa.get_landmarks_from_image(np.array(img))
-        
-        if detected_faces and len(detected_faces) > 0:
-            landmarks = detected_faces[0]
-            left = np.min(landmarks[:, 0])
-            top = np.min(landmarks[:, 1])
-            right = np.max(landmarks[:, 0])
-            bottom = np.max(landmarks[:, 1])
-            
-            width, height = right - left, bottom - top
-            center_x, center_y = (left + right) // 2, (top + bottom) // 2
-            size = int(max(width, height) * 1.5)
-            left = max(0, center_x - size // 2)
-            top = max(0, center_y - size // 2)
-            right = min(img.width, center_x + size // 2)
-            bottom = min(img.height, center_y + size // 2)
-            
-            img = img.crop((left, top, right, bottom))
-            logger.info("Face detected and cropped successfully")
-        else:
-            width, height = img.size
-            size = min(width, height)
-            left = (width - size) // 2
-            top = (height - size) // 2
-            img = img.crop((left, top, left + size, top + size))
-            logger.info("No face detected, using center crop")
-    except ImportError:
-        width, height = img.size
-        size = min(width, height)
-        left = (width - size) // 2
-        top = (height - size) // 2
-        img = img.crop((left, top, left + size, top + size))
-        logger.info("Face alignment module not available, using center crop")
+    if detected_faces and len(detected_faces) > 0:
+        logger.info(f"Detected {len(detected_faces)} face(s)")
+        return [landmarks_crop_box(landmarks, img.width, img.height) for landmarks in detected_faces]
+    
+    logger.info("No face detected, using center crop")
+    return [center_crop_box(*img.size)]
+
+def detect_crop_box(img):
+    """Crop box for the first face found in a PIL image"""
+    return detect_crop_boxes(img)[0]
+
+def get_crop_box(img, cache_key=None):
+    """Crop box for an image, memoized per upload so repeated edits skip detection"""
+    if cache_key is not None and cache_key in _crop_box_cache:
+        _crop_box_cache.move_to_end(cache_key)
+        return _crop_box_cache[cache_key]
+    
+    box = detect_crop_box(img)
+    if cache_key is not None:
+        _crop_box_cache[cache_key] = box
+        while len(_crop_box_cache) > MAX_CACHED_CROP_BOXES:
+            _crop_box_cache.popitem(last=False)
+    return box
+
+def crop_to_tensor(img, box):
+    """Crop, pad to square and normalize a PIL image into a (3, 256, 256) encoder input"""
+    img = img.crop(box)
     
     # Ensure square image
     width, height = img.size
@@ -287,71 +401,637 @@ def process_image(img_path, encoder, generator, output_path, truncation=0.7, noi
         img = new_img
 
     # HyperStyle expects 256x256 input images
-    img = img.resize((256, 256), Image.LANCZOS)
+    input_size = PREPROCESS_SETTINGS['input_size']
+    img = img.resize((input_size, input_size), Image.LANCZOS)
 
     transform = transforms.Compose([
         transforms.ToTensor(),
         transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
     ])
-    img_tensor = transform(img).unsqueeze(0).to(device)
+    return transform(img)
+
+def preprocess_image(img, cache_key=None):
+    """Crop the face out of a PIL image and turn it into a normalized encoder tensor"""
+    box = get_crop_box(img, cache_key)
+    return crop_to_tensor(img, box).unsqueeze(0).to(device)
+
+def align_images(img_paths):
+    """Align a list of images into one (N, 3, 256, 256) tensor.
+
+    Images of the same size share one batched face_alignment call, which is
+    much cheaper than detecting faces one image at a time during bulk ingestion.
+    """
+    images = [Image.open(path).convert('RGB') for path in img_paths]
+    boxes = [None] * len(images)
     
-    with torch.no_grad():
+    fa = get_face_detector()
+    if fa is None:
+        boxes = [center_crop_box(*img.size) for img in images]
+    else:
+        by_size = {}
+        for i, img in enumerate(images):
+            by_size.setdefault(img.size, []).append(i)
+        
+        for (width, height), indices in by_size.items():
+            batch = torch.stack([torch.from_numpy(np.array(images[i])).permute(2, 0, 1) for i in indices])
+            with torch.no_grad():
+                batch_landmarks = fa.get_landmarks_from_batch(batch.float().to(device))
+            for i, landmarks in zip(indices, batch_landmarks):
+                if landmarks is not None and len(landmarks) >= 68:
+                    # Faces come back concatenated, 68 points each; keep the first one
+                    boxes[i] = landmarks_crop_box(np.asarray(landmarks)[:68], width, height)
+                else:
+                    boxes[i] = center_crop_box(width, height)
+    
+    return torch.stack([crop_to_tensor(img, box) for img, box in zip(images, boxes)]).to(device)
+
+def get_latent_cache():
+    """Get the shared inversion latent cache"""
+    global _latent_cache
+    if _latent_cache is None:
+        _latent_cache = LatentCache(
+            cache_dir=os.environ.get('LATENT_CACHE_DIR', 'cache/latents'),
+            max_entries=int(os.environ.get('LATENT_CACHE_SIZE', 64)),
+            max_disk_bytes=int(os.environ.get('LATENT_CACHE_DISK_BYTES', 256 * 1024 ** 2))
+        )
+    return _latent_cache
+
+def latent_settings(**extra):
+    """Preprocessing and encoder settings that determine an inverted latent, for latent cache keys.
+
+    Includes the loaded encoder checkpoint's checksum, so swapping the
+    checkpoint does not reuse latents spilled to disk by the old one.
+    """
+    return dict(PREPROCESS_SETTINGS, encoder_mode=ENCODER_MODE, encoder=_render_identity.get('encoder'), **extra)
+
+def image_cache_key(img_path):
+    """Content-addressed cache key for an uploaded image and the current preprocessing"""
+    with open(img_path, 'rb') as f:
+        return make_cache_key(f.read(), latent_settings())
+
+def edits_skip_coarse_layers(config_path='config.json'):
+    """Whether any attribute in config.json is restricted to a W+ layer range that leaves the 4x4 rows alone"""
+    try:
+        with open(config_path, 'r') as f:
+            mappings = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return any(isinstance(mapping, dict) and mapping.get('layers', (0, NUM_WS))[0] > 0
+               for mapping in mappings.values())
+
+def get_feature_cache():
+    """Get the shared synthesis block output cache, or None when it is off.
+
+    It defaults to 256 MB only when some attribute leaves the coarse layers
+    untouched; otherwise every edit changes the first block and nothing could
+    be reused, so FEATURE_CACHE_BYTES defaults to 0.
+    """
+    if _feature_cache is None:
+        default_bytes = 256 * 1024 * 1024 if edits_skip_coarse_layers() else 0
+        configure_feature_cache(int(os.environ.get('FEATURE_CACHE_BYTES', default_bytes)),
+                                int(os.environ.get('FEATURE_CACHE_MAX_RES', 256)))
+    return _feature_cache or None
+
+def configure_feature_cache(max_bytes, max_resolution=256):
+    """Replace the block output cache; max_bytes=0 turns incremental synthesis off"""
+    global _feature_cache
+    _feature_cache = FeatureCache(max_bytes, max_resolution) if max_bytes > 0 else False
+    return _feature_cache or None
+
+def encode_tensors(img_tensors, encoder):
+    """Run the HyperStyle encoder on a batch of aligned (N, 3, 256, 256) tensors and return W+ latents"""
+    with torch.no_grad(), stage_timer('encode'):
         logger.info("Running HyperStyle encoder...")
-        hyperstyle_reconstruction_img, result_latent = encoder(img_tensor, return_latents=True)
+        # Always fp32: only synthesis is checked against an fp32 reference in configure_inference
+        hyperstyle_reconstruction_img, result_latent = encoder(img_tensors, return_latents=True)
         
-        latent_codes = result_latent
+        latent_codes = result_latent.float()
         
         if len(latent_codes.shape) == 2:
             logger.info("Expanding W space latent to W+ space")
-            num_layers = 18
-            latent_codes = latent_codes.unsqueeze(1).repeat(1, num_layers, 1)
-        
-        if truncation < 1.0:
+            latent_codes = latent_codes.unsqueeze(1).repeat(1, NUM_WS, 1)
+    return latent_codes
+
+def encode_faces(img_path, encoder, max_faces=16):
+    """Invert every face in a group photo with one batched encoder call.
+
+    Returns (latents, boxes): an (N, 18, 512) W+ tensor and the crop box of
+    each face in the original image. Both are cached per image content.
+    """
+    with open(img_path, 'rb') as f:
+        key = make_cache_key(f.read(), latent_settings(faces=max_faces))
+    
+    cache = get_latent_cache()
+    cached = cache.get(key)
+    boxes = _crop_box_cache.get(key)
+    if cached is not None and boxes is not None:
+        metrics.inc('latent_cache_requests_total', result='hit')
+        return torch.from_numpy(np.array(cached)).to(device), boxes
+    metrics.inc('latent_cache_requests_total', result='miss')
+    
+    img = Image.open(img_path).convert('RGB')
+    boxes = detect_crop_boxes(img)[:max_faces]
+    img_tensors = torch.stack([crop_to_tensor(img, box) for box in boxes]).to(device)
+    latent_codes = encode_tensors(img_tensors, encoder)
+    
+    cache.put(key, latent_codes.cpu().numpy())
+    _crop_box_cache[key] = boxes
+    while len(_crop_box_cache) > MAX_CACHED_CROP_BOXES:
+        _crop_box_cache.popitem(last=False)
+    return latent_codes, boxes
+
+def latent_from_array(array):
+    """Move a stored (N, 18, 512) latent array onto the inference device as float32"""
+    return torch.from_numpy(np.array(array, dtype=np.float32)).to(device)
+
+def encode_image(img_path, encoder):
+    """Invert an image into W+ space, reusing the cached latent when the same bytes were seen before"""
+    cache = get_latent_cache()
+    key = image_cache_key(img_path)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.inc('latent_cache_requests_total', result='hit')
+        logger.info(f"Using cached latent {key[:12]}")
+        return latent_from_array(cached)
+    metrics.inc('latent_cache_requests_total', result='miss')
+
+    img = Image.open(img_path).convert('RGB')
+    img_tensor = preprocess_image(img, cache_key=key)
+    latent_codes = encode_tensors(img_tensor, encoder)
+
+    cache.put(key, latent_codes.cpu().numpy())
+    return latent_codes
+
+# Rough peak activation memory for one 1024x1024 fp32 synthesis pass
+_SYNTHESIS_BYTES_PER_IMAGE = 768 * 1024 * 1024
+MAX_SYNTHESIS_BATCH = 8
+
+def available_memory_bytes():
+    """MemAvailable from /proc/meminfo: free memory plus page cache the kernel can reclaim"""
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    raise ValueError("MemAvailable not reported by /proc/meminfo")
+
+def synthesis_batch_size(generator):
+    """Pick how many images to synthesize at once from the memory currently available"""
+    resolution = getattr(generator, 'img_resolution', 1024)
+    per_image = _SYNTHESIS_BYTES_PER_IMAGE * (resolution / 1024) ** 2
+    try:
+        if device == 'cuda':
+            available, _ = torch.cuda.mem_get_info()
+        else:
+            available = available_memory_bytes()
+    except (AttributeError, ValueError, OSError, RuntimeError):
+        return 1
+    # Leave half of the free memory for everything else in the process
+    return int(max(1, min(MAX_SYNTHESIS_BATCH, available // 2 // per_image)))
+
+def split_edits(edits):
+    """Separate truncation/noise settings from GANSpace attribute strengths"""
+    edits = dict(edits)
+    truncation = float(edits.pop('truncation', 0.7))
+    noise_strength = float(edits.pop('noise_strength', 1.0))
+    attributes = {name: float(value) for name, value in edits.items()}
+    return truncation, noise_strength, attributes
+
+def canonical_edits(edits):
+    """Normalize an edits dict so requests that render the same image compare and hash equal"""
+    truncation, noise_strength, attributes = split_edits(edits)
+    canonical = {name: round(value, 4) for name, value in attributes.items() if abs(value) > 0.001}
+    canonical['truncation'] = round(min(truncation, 1.0), 4)
+    canonical['noise_strength'] = round(max(noise_strength, 0.0), 4)
+    return canonical
+
+def render_settings(config_path='config.json'):
+    """Process-wide settings that change rendered pixels, for render cache keys.
+
+    Covers the checkpoints and mean latent once they are loaded (see
+    _render_identity), the inference mode and the contents of config.json.
+    """
+    with open(config_path, 'rb') as f:
+        edit_config = hashlib.sha256(f.read()).hexdigest()
+    return dict(_render_identity, inference_mode=_inference['mode'], edit_config=edit_config)
+
+# PIL's ImageFilter.SMOOTH, the blur ImageEnhance.Sharpness blends against
+_SMOOTH_KERNEL = [[1.0, 1.0, 1.0], [1.0, 5.0, 1.0], [1.0, 1.0, 1.0]]
+_LUMA_WEIGHTS = [0.299, 0.587, 0.114]
+
+def enhance_images(images, sharpness=1.2, contrast=1.1):
+    """Batched tensor version of PIL's ImageEnhance.Sharpness followed by ImageEnhance.Contrast.
+
+    images is (N, 3, H, W) in [0, 1]. Like PIL, sharpening blends with a
+    3x3 smoothed copy and leaves the 1-pixel border alone, and contrast
+    blends with each image's mean luminance.
+    """
+    kernel = torch.tensor(_SMOOTH_KERNEL, device=images.device, dtype=images.dtype) / 13.0
+    smooth = F.conv2d(images, kernel.expand(3, 1, 3, 3), groups=3)
+    sharpened = images.clone()
+    sharpened[..., 1:-1, 1:-1] = torch.lerp(smooth, images[..., 1:-1, 1:-1], sharpness)
+    sharpened.clamp_(0, 1)
+    
+    luma = torch.tensor(_LUMA_WEIGHTS, device=images.device, dtype=images.dtype).view(1, 3, 1, 1)
+    mean = (sharpened * luma).sum(1, keepdim=True).mean((2, 3), keepdim=True)
+    return torch.lerp(mean, sharpened, contrast).clamp_(0, 1)
+
+def postprocess_tensor(synthetic_img, size=None):
+    """Enhance a batch of synthesized tensors in [-1, 1] on their device and return (N, H, W, 3) uint8 on the CPU.
+
+    size optionally downsamples to size x size before the single conversion
+    to uint8, so the device-to-host copy is as small as possible.
+    """
+    with stage_timer('postprocess'):
+        images = ((synthetic_img.float() + 1) * 0.5).clamp_(0, 1)
+        images = enhance_images(images)
+        if size and size != images.shape[-1]:
+            images = F.interpolate(images, size=(size, size), mode='bilinear', antialias=True,
+                                   align_corners=False).clamp_(0, 1)
+        return images.mul_(255).round_().to(torch.uint8).permute(0, 2, 3, 1).contiguous().cpu()
+
+def postprocess_images(synthetic_img, size=None):
+    """Convert a batch of synthesized tensors in [-1, 1] into enhanced PIL images"""
+    return [Image.fromarray(array) for array in postprocess_tensor(synthetic_img, size).numpy()]
+
+def prepare_latents(latent_codes, generator, edits_list):
+    """Build one truncated and edited W+ code per edits dict; returns the codes and noise strengths"""
+    split = [split_edits(edits) for edits in edits_list]
+    truncations = torch.tensor([t for t, _, _ in split], device=latent_codes.device).view(-1, 1, 1)
+    noise_strengths = [n for _, n, _ in split]
+    
+    with stage_timer('edit'):
+        all_latents = latent_codes.expand(len(edits_list), -1, -1)
+        if (truncations < 1.0).any():
             mean_latent = get_mean_latent(generator)
-            latent_codes = mean_latent + truncation * (latent_codes - mean_latent)
-            logger.info(f"Applied truncation with strength {truncation}")
-        
-        attribute_values = {
-            'gender': gender, 'smile': smile, 'pose': pose, 'age': age,
-            'lighting': lighting, 'hair_color': hair_color, 'hair_length': hair_length,
-            'expression': expression, 'eye_color': eye_color, 'eye_state': eye_state,
-            'serious_mood': serious_mood, 'maturity': maturity
-        }
-        
-        final_latent_codes_for_synthesis = latent_codes
+            truncated = mean_latent + truncations * (all_latents - mean_latent)
+            all_latents = torch.where(truncations < 1.0, truncated, all_latents)
+        all_latents = edit_latent_with_ganspace(all_latents.contiguous(), [a for _, _, a in split])
+    return all_latents, noise_strengths
+
+INFERENCE_MODES = ('fp32', 'bf16', 'channels_last', 'compiled', 'traced')
+
+def inference_autocast():
+    """Autocast context for the active inference mode (a no-op outside bf16)"""
+    device_type = 'cuda' if device == 'cuda' else 'cpu'
+    return torch.autocast(device_type, dtype=torch.bfloat16, enabled=_inference['mode'] == 'bf16')
+
+def _apply_inference_mode(generator, mode, batch_size):
+    synthesis = generator.synthesis
+    
+    # Restore any block flags changed by a previous channels_last mode
+    for res, (channels_last, use_fp16) in _inference['block_flags'].items():
+        block = getattr(synthesis, f'b{res}')
+        block.channels_last, block.use_fp16 = channels_last, use_fp16
+    _inference.update(mode=mode, batch_size=batch_size, compiled=None, compiled_noise=None, traced={},
+                      block_flags={})
+    # Cached block outputs were computed with the previous mode's numerics
+    if get_feature_cache() is not None:
+        get_feature_cache().clear()
+    
+    if mode == 'channels_last':
+        for res in synthesis.block_resolutions:
+            block = getattr(synthesis, f'b{res}')
+            _inference['block_flags'][res] = (block.channels_last, block.use_fp16)
+            # fp16 blocks are slow on CPU, so keep fp32 math and only change the layout
+            block.channels_last, block.use_fp16 = True, False
+    elif mode == 'compiled':
+        _inference['compiled'] = torch.compile(synthesis, dynamic=False)
+        _inference['compiled_noise'] = torch.compile(_synthesize_with_noise, dynamic=False)
+
+def _traced_synthesis(generator, batch_size, noise_mode):
+    key = (batch_size, noise_mode)
+    if key not in _inference['traced']:
+        logger.info(f"Tracing synthesis for batch size {batch_size}, noise_mode={noise_mode}")
+        example = torch.zeros(batch_size, generator.synthesis.num_ws, generator.w_dim, device=device)
+        _inference['traced'][key] = torch.jit.trace(
+            lambda ws: generator.synthesis(ws, noise_mode=noise_mode, force_fp32=True),
+            example, check_trace=False)
+    return _inference['traced'][key]
+
+def _traced_noise_synthesis(generator, batch_size):
+    """Traced synthesis that takes every noise layer's per-row noise as an input after ws"""
+    key = (batch_size, 'per_row')
+    if key not in _inference['traced']:
+        logger.info(f"Tracing synthesis for batch size {batch_size} with per-row noise")
+        synthesis = generator.synthesis
+        buffers = _noise_buffers(synthesis)
+        names = [name for name, _ in buffers]
+        example = (torch.zeros(batch_size, synthesis.num_ws, generator.w_dim, device=device),
+                   *(buffer.expand(batch_size, 1, *buffer.shape).contiguous() for _, buffer in buffers))
+        traced = torch.jit.trace(
+            lambda ws, *noise: _synthesize_with_noise(synthesis, ws, dict(zip(names, noise)), True),
+            example, check_trace=False)
+        _inference['traced'][key] = lambda ws, noise: traced(ws, *(noise[name] for name in names))
+    return _inference['traced'][key]
+
+def _psnr(reference, candidate):
+    """PSNR in dB between two image batches in [-1, 1]"""
+    mse = torch.mean((reference.float() - candidate.float()) ** 2).item()
+    return float('inf') if mse == 0 else 10 * np.log10(4.0 / mse)
+
+def configure_inference(generator, mode='fp32', batch_size=1, tolerance_db=35.0):
+    """Select the synthesis inference mode at startup; the encoder stays in ENCODER_MODE.
+
+    Non-fp32 modes are checked against eager fp32 renders of a fixed latent,
+    once with constant noise and once with seeded per-row noise; when either
+    PSNR falls below tolerance_db the generator falls back to fp32. Returns
+    the lower PSNR (None for fp32).
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode {mode!r}, expected one of {INFERENCE_MODES}")
+    
+    if mode == 'fp32':
+        _apply_inference_mode(generator, mode, batch_size)
+        return None
+    
+    rng = torch.Generator().manual_seed(0)
+    z = torch.randn(batch_size, generator.z_dim, generator=rng).to(device)
+    with torch.no_grad():
+        _apply_inference_mode(generator, 'fp32', batch_size)
+        ws = generator.mapping(z, None)
+        noise = make_noise(generator, [1.0] * batch_size, seeds=list(range(batch_size)))
+        reference = generator.synthesis(ws, noise_mode='const', force_fp32=True)
+        reference_noise = _synthesize_with_noise(generator.synthesis, ws, noise, True)
         
-        if any(abs(v) > 0.001 for v in attribute_values.values()):
-            edited_latent_codes = edit_latent_with_ganspace(latent_codes, attribute_values)
-            logger.info("Applied GANSpace attribute editing")
-            final_latent_codes_for_synthesis = edited_latent_codes
+        _apply_inference_mode(generator, mode, batch_size)
+        candidate = synthesize(generator, ws, noise_mode='const')
+        candidate_noise = synthesize(generator, ws, noise=noise)
+    
+    psnr = min(_psnr(reference, candidate), _psnr(reference_noise, candidate_noise))
+    if psnr < tolerance_db:
+        logger.warning(f"Inference mode {mode} PSNR {psnr:.1f} dB is below {tolerance_db} dB, using fp32")
+        _apply_inference_mode(generator, 'fp32', batch_size)
+    else:
+        logger.info(f"Using inference mode {mode} (PSNR {psnr:.1f} dB vs fp32)")
+    return psnr
+
+def _noise_buffers(synthesis):
+    """Names and constant buffers of every noise-injecting synthesis layer, indexed once per generator"""
+    key = id(synthesis)
+    if key not in _noise_buffer_index:
+        _noise_buffer_index[key] = [(name, buffer) for name, buffer in synthesis.named_buffers()
+                                    if name.endswith('noise_const')]
+    return _noise_buffer_index[key]
+
+def make_noise(generator, noise_strengths, seeds=None):
+    """Build per-row noise inputs for every noise layer of the generator.
+
+    Rows with noise_strength <= 0 get the layer's constant noise buffer;
+    other rows get Gaussian noise scaled by their strength, drawn from
+    seeds[i] when given so the render is reproducible. Returns a dict of
+    buffer name -> (N, 1, res, res) tensor for synthesize(noise=...).
+    """
+    rngs = []
+    for i, strength in enumerate(noise_strengths):
+        if strength <= 0:
+            rngs.append(None)
+            continue
+        seed = seeds[i] if seeds is not None else int(torch.randint(2 ** 31, ()).item())
+        rngs.append(torch.Generator().manual_seed(seed))
+    
+    noise = {}
+    for name, const in _noise_buffers(generator.synthesis):
+        rows = [const if rng is None else torch.randn(const.shape, generator=rng).to(const.device) * strength
+                for rng, strength in zip(rngs, noise_strengths)]
+        noise[name] = torch.stack(rows).unsqueeze(1)
+    return noise
+
+def synthesize(generator, ws, noise_mode='const', max_resolution=None, noise=None):
+    """Run generator.synthesis, optionally stopping after the block at max_resolution.
+
+    Stopping early returns the partial RGB output of that block, which is a
+    much cheaper preview than rendering the full 1024x1024 image. noise,
+    from make_noise, gives every row its own noise for a full render; it is
+    passed in place of the constant noise buffers, without touching the
+    shared generator.
+    """
+    # On CUDA this times kernel launches; waiting for the GPU shows up in the postprocess copy
+    with stage_timer('synthesize'):
+        img = _synthesize(generator, ws, noise_mode, max_resolution, noise)
+    metrics.inc('images_synthesized_total', ws.shape[0],
+                kind='full' if img.shape[-1] >= generator.synthesis.img_resolution else 'preview')
+    return img
+
+def _synthesize_with_noise(synthesis, ws, noise, force_fp32):
+    # Layers read noise_const * noise_strength, and an (N, 1, res, res) tensor broadcasts per row
+    return torch.func.functional_call(synthesis, noise, (ws,), {'noise_mode': 'const', 'force_fp32': force_fp32})
+
+def _synthesize(generator, ws, noise_mode, max_resolution, noise=None):
+    synthesis = generator.synthesis
+    mode = _inference['mode']
+    # Blocks only switch memory layout when force_fp32 is off; channels_last mode cleared their fp16 flag
+    force_fp32 = mode != 'channels_last'
+    full = not max_resolution or max_resolution >= synthesis.img_resolution
+    if noise is not None and not full:
+        raise ValueError("Per-row noise is only supported for full-resolution synthesis")
+    
+    with inference_autocast():
+        if noise is not None and mode == 'traced' and ws.shape[0] == _inference['batch_size']:
+            img = _traced_noise_synthesis(generator, ws.shape[0])(ws, noise)
+        elif noise is not None and mode == 'compiled':
+            img = _inference['compiled_noise'](synthesis, ws, noise, True)
+        elif noise is not None:
+            img = _synthesize_with_noise(synthesis, ws, noise, force_fp32)
+        elif full and mode == 'traced' and ws.shape[0] == _inference['batch_size']:
+            img = _traced_synthesis(generator, ws.shape[0], noise_mode)(ws)
+        elif full and mode == 'compiled':
+            img = _inference['compiled'](ws, noise_mode=noise_mode, force_fp32=True)
+        elif full and (get_feature_cache() is None or noise_mode != 'const'):
+            img = synthesis(ws, noise_mode=noise_mode, force_fp32=force_fp32)
         else:
-            logger.info("No attribute editing applied.")
-        
-        noise_mode = 'const' if noise_strength <= 0 else 'random'
+            img = _synthesize_blocks(synthesis, ws, noise_mode, force_fp32, max_resolution)
+        return img.float()
 
-        
-        for module in generator.synthesis.modules():
-            if 'Conv2dLayer' in str(type(module)) and hasattr(module, 'noise_strength'):
-                module.noise_strength = noise_strength
-        
-        
-        logger.info("Generating synthetic face with StyleGAN generator...")
-        synthetic_img = generator.synthesis(final_latent_codes_for_synthesis,
-                                            noise_mode=noise_mode,
-                                            force_fp32=True)
-        
-        synthetic_img = (synthetic_img + 1) * 0.5
-        synthetic_img = torch.clamp(synthetic_img, 0, 1)
+def _synthesize_blocks(synthesis, ws, noise_mode, force_fp32, max_resolution=None):
+    """Run the synthesis blocks one by one, resuming after the deepest block output cached for every row.
+
+    Only constant-noise renders use the cache, since random noise would make
+    a resumed render differ from a fresh one.
+    """
+    blocks = []
+    w_idx = 0
+    for res in synthesis.block_resolutions:
+        block = getattr(synthesis, f'b{res}')
+        num_ws = block.num_conv + block.num_torgb
+        if not max_resolution or res <= max_resolution:
+            blocks.append((res, block, ws.narrow(1, w_idx, num_ws), w_idx + num_ws))
+        w_idx += block.num_conv
+    
+    cache = get_feature_cache() if noise_mode == 'const' else None
+    num_cached = sum(1 for res, _, _, _ in blocks if cache is not None and res <= cache.max_resolution)
+    keys = None
+    start = 0
+    x = img = None
+    if num_cached:
+        keys = block_prefix_keys(ws.detach().float().cpu().numpy(), [end for _, _, _, end in blocks[:num_cached]],
+                                 salt=f"{id(synthesis)}|{_inference['mode']}|{noise_mode}")
+        for i in reversed(range(num_cached)):
+            hits = [cache.get(row_keys[i]) for row_keys in keys]
+            if all(hit is not None for hit in hits):
+                x = torch.stack([hit_x for hit_x, _ in hits])
+                img = torch.stack([hit_img for _, hit_img in hits])
+                start = i + 1
+                metrics.inc('feature_cache_resumes_total', resolution=blocks[i][0])
+                break
+    
+    for i in range(start, len(blocks)):
+        _, block, cur_ws, _ = blocks[i]
+        x, img = block(x, img, cur_ws, noise_mode=noise_mode, force_fp32=force_fp32)
+        if i < num_cached:
+            for row, row_keys in enumerate(keys):
+                cache.put(row_keys[i], x[row].clone(), img[row].clone())
+    return img
+
+def image_to_bytes(img, format='PNG', **save_kwargs):
+    """Encode a PIL image in memory"""
+    buffer = io.BytesIO()
+    with stage_timer('image_encode'):
+        img.save(buffer, format=format, **save_kwargs)
+    return buffer.getvalue()
+
+def render_preview(latent_codes, generator, edits, resolution=256, quality=85):
+    """Render a low-resolution JPEG preview of one edit set and return the encoded bytes"""
+    with torch.no_grad():
+        all_latents, noise_strengths = prepare_latents(latent_codes, generator, [edits])
+        noise_mode = 'const' if noise_strengths[0] <= 0 else 'random'
+        synthetic_img = synthesize(generator, all_latents, noise_mode=noise_mode, max_resolution=resolution)
     
-    synthetic_pil = transforms.ToPILImage()(synthetic_img.squeeze(0).cpu())
+    return image_to_bytes(postprocess_images(synthetic_img)[0], format='JPEG', quality=quality)
+
+def render_sweep(latent_codes, generator, base_edits, attribute, values, resolution=256, batch_size=None):
+    """Render base_edits with one attribute swept over values, as low-resolution frames.
+
+    Frames use the generator's constant noise so scrubbing through them does
+    not flicker. Returns one PIL image per value.
+    """
+    edits_list = [dict(base_edits, **{attribute: value}) for value in values]
+    full_resolution = generator.synthesis.img_resolution
+    # Activation memory shrinks with the square of the resolution, so far more frames fit in a batch
+    batch_size = batch_size or synthesis_batch_size(generator) * max(1, (full_resolution // resolution) ** 2)
     
-    enhancer = ImageEnhance.Sharpness(synthetic_pil)
-    synthetic_pil = enhancer.enhance(1.2)
+    frames = []
+    with torch.no_grad():
+        all_latents, _ = prepare_latents(latent_codes, generator, edits_list)
+        for start in range(0, len(edits_list), batch_size):
+            synthetic_img = synthesize(generator, all_latents[start:start + batch_size], noise_mode='const',
+                                       max_resolution=resolution)
+            frames.extend(postprocess_images(synthetic_img))
+    return frames
+
+def pack_sprite_sheet(frames, columns):
+    """Tile equally sized frames row by row into one image"""
+    width, height = frames[0].size
+    rows = (len(frames) + columns - 1) // columns
+    sheet = Image.new('RGB', (width * columns, height * rows))
+    for i, frame in enumerate(frames):
+        sheet.paste(frame, ((i % columns) * width, (i // columns) * height))
+    return sheet
+
+def composite_faces(img, faces, boxes, feather=0.08):
+    """Paste rendered faces back over their crop boxes in the original image, with feathered edges"""
+    composite = img.copy()
+    for face, box in zip(faces, boxes):
+        left, top, right, bottom = (int(round(v)) for v in box)
+        width, height = right - left, bottom - top
+        # crop_to_tensor padded non-square crops to a centered square; undo that padding
+        size = max(width, height)
+        pad_x, pad_y = (size - width) // 2, (size - height) // 2
+        face = face.resize((size, size), Image.LANCZOS).crop((pad_x, pad_y, pad_x + width, pad_y + height))
+        
+        margin = int(min(width, height) * feather)
+        mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(mask).ellipse((margin, margin, width - margin, height - margin), fill=255)
+        mask = mask.filter(ImageFilter.GaussianBlur(max(1, margin // 2)))
+        composite.paste(face, (left, top), mask)
+    return composite
+
+def render_variations(latent_codes, generator, edits_list, output_paths=None, batch_size=None, noise_seeds=None,
+                      size=None):
+    """Render N edit dictionaries of a single base latent with batched synthesis.
+
+    Each entry of edits_list has the shape of the "edits" objects in
+    products.json / scenes.json. latent_codes may also hold N latents, one
+    per edits dict. noise_strength scales each render's random noise (0 uses
+    the generator's constant noise), and noise_seeds optionally fixes that
+    noise so the render is reproducible. Rows with different noise settings
+    share synthesis batches. size optionally scales the output down to
+    size x size. Returns the rendered PIL images in order and saves them to
+    output_paths when given.
+    """
+    if not edits_list:
+        return []
+    batch_size = batch_size or synthesis_batch_size(generator)
+
+    with torch.no_grad():
+        all_latents, noise_strengths = prepare_latents(latent_codes, generator, edits_list)
+
+        images = []
+        for start in range(0, len(edits_list), batch_size):
+            end = min(start + batch_size, len(edits_list))
+            strengths = noise_strengths[start:end]
+            logger.info(f"Synthesizing batch of {end - start} with StyleGAN generator...")
+            if all(s <= 0 for s in strengths):
+                synthetic_img = synthesize(generator, all_latents[start:end], noise_mode='const')
+            elif noise_seeds is None and all(s == 1.0 for s in strengths):
+                # The layers' own random noise at their learned strength; no per-row inputs needed
+                synthetic_img = synthesize(generator, all_latents[start:end], noise_mode='random')
+            else:
+                seeds = noise_seeds[start:end] if noise_seeds is not None else None
+                synthetic_img = synthesize(generator, all_latents[start:end],
+                                           noise=make_noise(generator, strengths, seeds))
+            images.extend(postprocess_images(synthetic_img, size))
+
+    if output_paths:
+        for img, output_path in zip(images, output_paths):
+            img.save(output_path)
+            logger.info(f"Saved HyperStyle + GANSpace edited synthetic image to {output_path}")
+    return images
+
+def sample_latents(generator, seeds, batch_size=256):
+    """Map integer seeds to W+ latents without the encoder, in large mapping batches.
+
+    z is drawn from np.random.RandomState(seed) as in the StyleGAN2 scripts,
+    so a seed always produces the same identity.
+    """
+    zs = np.stack([np.random.RandomState(seed).randn(generator.z_dim) for seed in seeds])
+    latents = []
+    with torch.no_grad():
+        for start in range(0, len(zs), batch_size):
+            z = torch.from_numpy(zs[start:start + batch_size]).float().to(device)
+            latents.append(generator.mapping(z, None))
+    return torch.cat(latents)
+
+def render_seeds(generator, seeds, edits=None, output_paths=None, batch_size=None):
+    """Render new synthetic identities from seeds with one set of truncation/GANSpace edits.
+
+    Noise is forced to the generator's constant buffers so the same seed and
+    edits always give the same image.
+    """
+    edits = dict(edits or {}, noise_strength=0.0)
+    latent_codes = sample_latents(generator, seeds)
+    return render_variations(latent_codes, generator, [edits] * len(seeds), output_paths, batch_size)
+
+def render_latent(latent_codes, generator, output_path, truncation=0.7, noise_strength=1.0, **attributes):
+    """Apply truncation and GANSpace edits to W+ latents and synthesize the result"""
+    edits = dict(attributes, truncation=truncation, noise_strength=noise_strength)
+    return render_variations(latent_codes, generator, [edits], [output_path])[0]
+
+def process_image(img_path, encoder, generator, output_path, truncation=0.7, noise_strength=1.0, 
+                  gender=0.0, smile=0.0, pose=0.0, age=0.0, lighting=0.0, hair_color=0.0, 
+                  hair_length=0.0, expression=0.0, eye_color=0.0, eye_state=0.0, 
+                  serious_mood=0.0, maturity=0.0):
+    attribute_values = {
+        'gender': gender, 'smile': smile, 'pose': pose, 'age': age,
+        'lighting': lighting, 'hair_color': hair_color, 'hair_length': hair_length,
+        'expression': expression, 'eye_color': eye_color, 'eye_state': eye_state,
+        'serious_mood': serious_mood, 'maturity': maturity
+    }
+    logger.debug(f"Processing image with truncation={truncation}, noise_strength={noise_strength}, "
+                 f"attributes={attribute_values}")
     
-    enhancer = ImageEnhance.Contrast(synthetic_pil)
-    synthetic_pil = enhancer.enhance(1.1)
+    latent_codes = encode_image(img_path, encoder)
     
-    synthetic_pil.save(output_path)
-    logger.info(f"Saved HyperStyle + GANSpace edited synthetic image to {output_path}")
+    render_latent(latent_codes, generator, output_path, truncation=truncation,
+                  noise_strength=noise_strength, **attribute_values)
     
-    return attribute_values
\ No newline at end of file
+    return attribute_values
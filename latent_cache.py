@@ -0,0 +1,108 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(image_bytes, settings):
+    """Build a content-addressed key from the raw image bytes and preprocessing settings"""
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    for name in sorted(settings):
+        digest.update(f"|{name}={settings[name]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class LatentCache:
+    """LRU store of inverted W+ latents that spills to .npy files on disk.
+
+    Entries are kept as float32 NumPy arrays so they can be shared between
+    devices; callers convert them back to tensors on demand. The spill
+    directory is pruned oldest-first once it grows past max_disk_bytes.
+    """
+
+    def __init__(self, cache_dir='cache/latents', max_entries=64, max_disk_bytes=256 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            try:
+                latent = np.load(self._disk_path(key), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                logger.warning(f"Discarding unreadable cached latent {key}: {e}")
+                return None
+            self._remember(key, latent)
+            return latent
+        return None
+
+    def put(self, key, latent):
+        latent = np.ascontiguousarray(latent, dtype=np.float32)
+        if self.cache_dir:
+            is_new_file = not os.path.exists(self._disk_path(key))
+            tmp_path = self._disk_path(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, latent)
+            os.replace(tmp_path, self._disk_path(key))
+            if is_new_file:
+                self._disk_bytes += os.path.getsize(self._disk_path(key))
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._prune()
+        self._remember(key, latent)
+        return latent
+
+    def _prune(self):
+        """Delete the least recently written latents until the directory is back under 90% of its budget"""
+        files = sorted((entry for entry in os.scandir(self.cache_dir) if entry.is_file()),
+                       key=lambda entry: entry.stat().st_mtime)
+        removed = 0
+        for entry in files:
+            if self._disk_bytes <= self.max_disk_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            removed += 1
+        logger.info(f"Pruned {removed} cached latent(s) from {self.cache_dir}")
+
+    def _remember(self, key, latent):
+        with self._lock:
+            self._entries[key] = latent
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.debug(f"Evicted latent {evicted_key} from memory cache")
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.cache_dir) and os.path.exists(self._disk_path(key))
+
+    def __len__(self):
+        """Number of latents held in memory"""
+        with self._lock:
+            return len(self._entries)
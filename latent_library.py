@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NUM_WS = 18
+W_DIM = 512
+SEARCH_SPACES = ('w', 'w+')
+
+
+class LSHIndex:
+    """Random-hyperplane LSH for cosine similarity.
+
+    Vectors are centered before hashing, since W latents share a large
+    common offset that would otherwise put them all in the same buckets.
+    Queries probe their own bucket and every bucket one bit away in each
+    table; callers re-rank the returned candidates exactly.
+    """
+
+    def __init__(self, dim, center, num_tables=8, num_bits=12, seed=0):
+        rng = np.random.RandomState(seed)
+        self.planes = rng.randn(num_tables, num_bits, dim).astype(np.float32)
+        self.center = center.astype(np.float32)
+        self.tables = [defaultdict(list) for _ in range(num_tables)]
+        self._powers = 1 << np.arange(num_bits)
+
+    def _hashes(self, vectors):
+        bits = np.einsum('tbd,nd->ntb', self.planes, vectors.astype(np.float32) - self.center) > 0
+        return (bits * self._powers).sum(-1)
+
+    def add(self, start, vectors, chunk_size=1024):
+        for chunk_start in range(0, len(vectors), chunk_size):
+            hashes = self._hashes(vectors[chunk_start:chunk_start + chunk_size])
+            for offset, row_hashes in enumerate(hashes, start + chunk_start):
+                for table, bucket in zip(self.tables, row_hashes):
+                    table[int(bucket)].append(offset)
+
+    def candidates(self, vector):
+        found = set()
+        for table, bucket in zip(self.tables, self._hashes(vector[None])[0]):
+            bucket = int(bucket)
+            found.update(table.get(bucket, ()))
+            for power in self._powers:
+                found.update(table.get(bucket ^ int(power), ()))
+        return found
+
+
+class LatentLibrary:
+    """Durable store of inverted W+ latents with metadata and similarity search.
+
+    Latents are appended as float16 rows to <root>/latents.f16 and read
+    back through a memory map; their per-identity W means (the average of
+    the 18 W+ rows) go to <root>/means.f16 for the W-space index. Metadata
+    is one JSON line per entry in <root>/entries.jsonl, and optional
+    thumbnails are kept as <root>/thumbnails/<id>.jpg.
+
+    Libraries with up to exact_below entries are searched exhaustively;
+    larger ones go through an LSH index that is rebuilt as the library grows.
+    """
+
+    def __init__(self, root='library', exact_below=2048):
+        self.root = root
+        self.exact_below = exact_below
+        self._lock = threading.Lock()
+        self._latents_path = os.path.join(root, 'latents.f16')
+        self._means_path = os.path.join(root, 'means.f16')
+        self._entries_path = os.path.join(root, 'entries.jsonl')
+        self._thumbnail_dir = os.path.join(root, 'thumbnails')
+        os.makedirs(self._thumbnail_dir, exist_ok=True)
+
+        self.entries = {}
+        if os.path.exists(self._entries_path):
+            with open(self._entries_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['id']] = entry
+        self._order = sorted(self.entries.values(), key=lambda entry: entry['row'])
+        self._latents = None
+        self._means = None
+        self._indexes = {}
+        logger.info(f"Latent library at {root} holds {len(self.entries)} identities")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, entry_id):
+        return entry_id in self.entries
+
+    def _rows(self, path, row_size):
+        if not os.path.exists(path):
+            return np.zeros((0, row_size), dtype=np.float16)
+        count = os.path.getsize(path) // (row_size * 2)
+        if count == 0:
+            return np.zeros((0, row_size), dtype=np.float16)
+        return np.memmap(path, dtype=np.float16, mode='r', shape=(count, row_size))
+
+    def _refresh(self):
+        self._latents = self._rows(self._latents_path, NUM_WS * W_DIM)
+        self._means = np.array(self._rows(self._means_path, W_DIM))
+
+    def add(self, latent, name='', tags=(), source=None, thumbnail=None):
+        """Store one (18, 512) or (1, 18, 512) W+ latent and return its entry"""
+        latent = np.asarray(latent, dtype=np.float32).reshape(NUM_WS, W_DIM)
+        entry = {
+            'id': uuid.uuid4().hex,
+            'name': name,
+            'tags': list(tags),
+            'source': source,
+            'created': time.time(),
+        }
+        with self._lock:
+            row_bytes = NUM_WS * W_DIM * 2
+            entry['row'] = os.path.getsize(self._latents_path) // row_bytes if os.path.exists(self._latents_path) else 0
+            with open(self._latents_path, 'ab') as f:
+                f.seek(entry['row'] * row_bytes)
+                f.truncate()
+                f.write(latent.astype(np.float16).tobytes())
+            with open(self._means_path, 'ab') as f:
+                f.seek(entry['row'] * W_DIM * 2)
+                f.truncate()
+                f.write(latent.mean(0).astype(np.float16).tobytes())
+            if thumbnail is not None:
+                with open(os.path.join(self._thumbnail_dir, f"{entry['id']}.jpg"), 'wb') as f:
+                    f.write(thumbnail)
+            with open(self._entries_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+            self.entries[entry['id']] = entry
+            self._order.append(entry)
+            self._refresh()
+            for space, index in list(self._indexes.items()):
+                if len(self._order) > 2 * index['size']:
+                    del self._indexes[space]
+                else:
+                    index['lsh'].add(entry['row'], self._vectors(space)[entry['row']:entry['row'] + 1])
+                    index['rows'].append(entry['row'])
+        logger.info(f"Added {entry['id']} to the latent library")
+        return entry
+
+    def get(self, entry_id):
+        """The stored W+ latent of an entry as a float32 (1, 18, 512) array"""
+        entry = self.entries[entry_id]
+        with self._lock:
+            if self._latents is None or entry['row'] >= len(self._latents):
+                self._refresh()
+            return np.array(self._latents[entry['row']], dtype=np.float32).reshape(1, NUM_WS, W_DIM)
+
+    def thumbnail_path(self, entry_id):
+        path = os.path.join(self._thumbnail_dir, f"{entry_id}.jpg")
+        return path if os.path.exists(path) else None
+
+    def list(self, query=None, limit=50):
+        """Entries newest first, optionally filtered by a substring of the name or a tag"""
+        entries = reversed(self._order)
+        if query:
+            query = query.lower()
+            entries = (entry for entry in entries
+                       if query in entry['name'].lower() or any(query == tag.lower() for tag in entry['tags']))
+        return [entry for _, entry in zip(range(limit), entries)]
+
+    def _vectors(self, space):
+        return self._means if space == 'w' else self._latents.reshape(len(self._latents), -1)
+
+    def _index(self, space):
+        index = self._indexes.get(space)
+        if index is None:
+            vectors = self._vectors(space)
+            rows = [entry['row'] for entry in self._order]
+            center = np.asarray(vectors[rows], dtype=np.float32).mean(0)
+            lsh = LSHIndex(vectors.shape[1], center)
+            lsh.add(0, vectors)
+            index = self._indexes[space] = {'lsh': lsh, 'rows': rows, 'size': len(rows)}
+        return index
+
+    def search(self, latent, k=5, space='w', exclude=()):
+        """Nearest stored identities to a W+ latent by cosine similarity in W (mean of rows) or W+ space"""
+        if space not in SEARCH_SPACES:
+            raise ValueError(f"Unknown search space {space!r}, expected one of {SEARCH_SPACES}")
+        latent = np.asarray(latent, dtype=np.float32).reshape(NUM_WS, W_DIM)
+        query = latent.mean(0) if space == 'w' else latent.reshape(-1)
+
+        with self._lock:
+            if not self._order:
+                return []
+            if self._latents is None:
+                self._refresh()
+            vectors = self._vectors(space)
+            if len(self._order) <= self.exact_below:
+                rows = [entry['row'] for entry in self._order]
+                center = np.asarray(vectors[rows], dtype=np.float32).mean(0)
+            else:
+                index = self._index(space)
+                rows = sorted(index['lsh'].candidates(query))
+                center = index['lsh'].center
+            by_row = {entry['row']: entry for entry in self._order}
+            rows = [row for row in rows if row in by_row and by_row[row]['id'] not in exclude]
+            if not rows:
+                return []
+
+            candidates = np.asarray(vectors[rows], dtype=np.float32) - center
+        query = query - center
+        scores = candidates @ query / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(query) + 1e-8)
+        best = np.argsort(-scores)[:k]
+        return [dict(by_row[rows[i]], score=float(scores[i])) for i in best]
@@ -0,0 +1,209 @@
+import sys
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage timings recorded while a collector is active in the current context
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, _label_key(labels))] += value
+
+    def gauge(self, name, fn, **labels):
+        """Register a callable that is evaluated on every scrape"""
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = fn
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+            histograms = sorted((key, dict(hist, counts=list(hist['counts'])))
+                                for key, hist in self._histograms.items())
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), fn in gauges:
+            try:
+                value = float(fn())
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+                continue
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), hist in histograms:
+            header(name, 'histogram')
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.describe('pipeline_stage_seconds', "Time spent in each inversion/editing pipeline stage")
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a pipeline stage into the stage histogram and the active timing collector"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe('pipeline_stage_seconds', elapsed, stage=stage)
+        collected = _timings.get()
+        if collected is not None:
+            collected.append((stage, elapsed))
+
+
+@contextmanager
+def collect_timings(target=None):
+    """Collect (stage, seconds) pairs recorded by stage_timer in this context"""
+    collected = target if target is not None else []
+    token = _timings.set(collected)
+    try:
+        yield collected
+    finally:
+        _timings.reset(token)
+
+
+def server_timing_header(timings):
+    """Format collected timings as a Server-Timing header, summing repeated stages"""
+    totals = defaultdict(float)
+    for stage, seconds in timings:
+        totals[stage] += seconds
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+class SamplingProfiler:
+    """Low-overhead wall-clock profiler that periodically samples every thread's stack.
+
+    Samples are aggregated as collapsed stacks ("file:function;file:function"),
+    the input format of flame graph tools.
+    """
+
+    def __init__(self, interval=0.01, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.sample_count = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        if self.running:
+            return
+        if interval:
+            self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started ({self.interval * 1000:.0f}ms interval)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logger.info("Sampling profiler stopped")
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.sample_count = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(f"{frame.f_code.co_filename}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            with self._lock:
+                self.samples.update(stacks)
+                self.sample_count += 1
+
+    def report(self, top=50):
+        with self._lock:
+            sample_count = self.sample_count
+            stacks = self.samples.most_common(top)
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'samples': sample_count,
+            'stacks': [{'stack': stack, 'count': count} for stack, count in stacks],
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,223 @@
+"""Model files listed in models.json with their checksums, plus the git submodules they need.
+
+Runtime code only ever verifies what is on disk (verify_artifact,
+add_source_paths) and fails fast when something is missing or corrupt;
+fetching is left to prefetch(), which download_models.py runs ahead of time.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.environ.get('MODEL_MANIFEST', 'models.json')
+PREFETCH_HINT = "run `python download_models.py` to fetch or repair it"
+SUBMODULE_HINT = "run `git submodule update --init` to check it out"
+
+_manifest = None
+
+
+class ModelArtifactError(RuntimeError):
+    """A model file or source submodule is missing or does not match the manifest"""
+
+
+def load_manifest(path=None):
+    """The parsed manifest; the default one is read once and kept"""
+    global _manifest
+    if path is not None:
+        with open(path, 'r') as f:
+            return json.load(f)
+    if _manifest is None:
+        with open(MANIFEST_PATH, 'r') as f:
+            _manifest = json.load(f)
+    return _manifest
+
+
+def _hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _write_stamp(path, digest):
+    try:
+        with open(path + '.verified', 'w') as f:
+            f.write(f"{_signature(path)} {digest}")
+    except OSError:
+        pass
+
+
+def file_sha256(path):
+    """SHA-256 of a file, remembered in <path>.verified until the file's size or mtime changes"""
+    try:
+        with open(path + '.verified', 'r') as f:
+            signature, digest = f.read().split()
+        if signature == _signature(path):
+            return digest
+    except (OSError, ValueError):
+        pass
+    digest = _hash_file(path)
+    _write_stamp(path, digest)
+    return digest
+
+
+def _check(entry):
+    path = entry['path']
+    if not os.path.exists(path):
+        raise ModelArtifactError(f"{path} is missing; {PREFETCH_HINT}")
+    size = os.path.getsize(path)
+    if entry.get('size') is not None and size != entry['size']:
+        raise ModelArtifactError(f"{path} is {size} bytes, expected {entry['size']}; {PREFETCH_HINT}")
+    if entry.get('sha256') and file_sha256(path) != entry['sha256']:
+        raise ModelArtifactError(f"{path} does not match its manifest checksum; {PREFETCH_HINT}")
+
+
+def verify_artifact(path, manifest=None):
+    """Check a model file against its manifest entry before it is loaded.
+
+    Files the manifest does not list (e.g. custom checkpoints passed on the
+    command line) are loaded unverified with a warning.
+    """
+    manifest = manifest or load_manifest()
+    entry = next((entry for entry in manifest['artifacts']
+                  if os.path.normpath(entry['path']) == os.path.normpath(path)), None)
+    if entry is None:
+        logger.warning(f"{path} is not listed in the model manifest, loading it unverified")
+        if not os.path.exists(path):
+            raise ModelArtifactError(f"{path} is missing")
+        return path
+    _check(entry)
+    return path
+
+
+def _source_ready(entry):
+    return os.path.exists(os.path.join(entry['path'], entry['check']))
+
+
+def add_source_paths(manifest=None):
+    """Put the HyperStyle and stylegan2-ada-pytorch submodules on sys.path; never checks them out"""
+    manifest = manifest or load_manifest()
+    for entry in manifest['sources']:
+        if not _source_ready(entry):
+            raise ModelArtifactError(f"Submodule {entry['path']} is not checked out; {SUBMODULE_HINT}")
+        path = os.path.abspath(entry['path'])
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def _download(url, part_path, expected_size=None, timeout=60):
+    """Download url into part_path, resuming from whatever a previous attempt left there"""
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if expected_size is not None and offset >= expected_size:
+        if offset == expected_size:
+            return
+        offset = 0
+    request = urllib.request.Request(url, headers={'Range': f"bytes={offset}-"} if offset else {})
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:
+            return
+        raise
+    with response:
+        if offset and response.status != 206:
+            logger.info(f"{url} does not support resuming, starting over")
+            offset = 0
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            shutil.copyfileobj(response, f, 1024 * 1024)
+
+
+def _fetch_file(path, urls, sha256=None, size=None, retries=3):
+    """Download one file to path from the first of urls that yields the expected checksum"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    part_path = path + '.part'
+    errors = []
+    for url in urls:
+        for attempt in range(retries):
+            try:
+                _download(url, part_path, size)
+                break
+            except (OSError, urllib.error.URLError) as e:
+                logger.warning(f"Downloading {path} from {url} failed (attempt {attempt + 1}): {e}")
+        else:
+            errors.append(f"{url}: download failed")
+            continue
+
+        digest = _hash_file(part_path)
+        if sha256 and digest != sha256:
+            os.remove(part_path)
+            errors.append(f"{url}: checksum mismatch")
+            continue
+        if not sha256:
+            logger.warning(f"{path} has no pinned checksum; downloaded sha256 is {digest}")
+        os.replace(part_path, path)
+        _write_stamp(path, digest)
+        return
+    raise ModelArtifactError(f"Could not fetch {path}: {'; '.join(errors) or 'no URLs in the manifest'}")
+
+
+def fetch_artifact(entry):
+    """Verify one model file, downloading it when it is missing or corrupt"""
+    if os.path.exists(entry['path']):
+        try:
+            _check(entry)
+            return 'verified'
+        except ModelArtifactError as e:
+            logger.warning(str(e))
+    _fetch_file(entry['path'], entry.get('urls', []), entry.get('sha256'), entry.get('size'))
+    return 'fetched'
+
+
+def fetch_source(entry):
+    """Check out a source submodule at the commit the repository pins, unless it is already there"""
+    if _source_ready(entry):
+        return 'verified'
+    try:
+        subprocess.run(['git', 'submodule', 'update', '--init', '--', entry['path']],
+                       check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise ModelArtifactError(f"git submodule update failed for {entry['path']}: {e.stderr.strip()}")
+    if not _source_ready(entry):
+        raise ModelArtifactError(f"Submodule {entry['path']} does not contain {entry['check']}")
+    return 'fetched'
+
+
+def prefetch(manifest=None, workers=4, verify_only=False):
+    """Verify, and unless verify_only also fetch, everything in the manifest in parallel.
+
+    Returns {path: status}, where status is 'verified', 'fetched' or an error message.
+    """
+    manifest = manifest or load_manifest()
+
+    def run(task):
+        kind, entry = task
+        try:
+            if verify_only:
+                if kind == 'source':
+                    if not _source_ready(entry):
+                        raise ModelArtifactError(f"Submodule {entry['path']} is not checked out")
+                else:
+                    _check(entry)
+                return entry['path'], 'verified'
+            return entry['path'], fetch_source(entry) if kind == 'source' else fetch_artifact(entry)
+        except (ModelArtifactError, OSError, ValueError) as e:
+            return entry['path'], f"error: {e}"
+
+    tasks = ([('artifact', entry) for entry in manifest['artifacts']]
+             + [('source', entry) for entry in manifest['sources']])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(run, tasks))
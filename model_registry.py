@@ -0,0 +1,82 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ModelsNotReady(RuntimeError):
+    """Raised when a model is requested before loading has finished"""
+
+
+class ModelRegistry:
+    """Loads models in named phases, either inline or on a background thread.
+
+    Each phase is a (name, loader) pair; loader receives the dict of models
+    loaded so far and its return value is stored under name. Per-phase
+    timings and errors are kept for the readiness endpoint.
+    """
+
+    def __init__(self, phases):
+        self.phases = list(phases)
+        self.models = {}
+        self.timings = {}
+        self.error = None
+        self._state = {name: 'pending' for name, _ in self.phases}
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self.error is None
+
+    def load(self):
+        """Run every phase in order on the calling thread"""
+        with self._lock:
+            if self._ready.is_set():
+                return
+            started = time.perf_counter()
+            try:
+                for name, loader in self.phases:
+                    self._state[name] = 'loading'
+                    phase_start = time.perf_counter()
+                    self.models[name] = loader(self.models)
+                    self.timings[name] = time.perf_counter() - phase_start
+                    self._state[name] = 'ready'
+                    logger.info(f"Loaded {name} in {self.timings[name]:.2f}s")
+            except Exception as e:
+                self._state[name] = 'error'
+                self.error = f"{name}: {e}"
+                logger.error(f"Model loading failed in phase {name}: {e}")
+            finally:
+                self.timings['total'] = time.perf_counter() - started
+                self._ready.set()
+
+    def start(self):
+        """Load on a background thread so the server can answer health checks meanwhile"""
+        if self._thread is None and not self._ready.is_set():
+            self._thread = threading.Thread(target=self.load, name='model-loader', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout) and self.error is None
+
+    def get(self, name, timeout=None):
+        """Return a loaded model, waiting up to timeout seconds for loading to finish"""
+        if not self._ready.wait(timeout):
+            raise ModelsNotReady("Models are still loading")
+        if self.error is not None:
+            raise ModelsNotReady(f"Model loading failed ({self.error})")
+        return self.models[name]
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'error': self.error,
+            'phases': {
+                name: {'status': self._state[name], 'seconds': self.timings.get(name)}
+                for name, _ in self.phases
+            },
+            'total_seconds': self.timings.get('total'),
+        }
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from image_store import ImageStore
+
+logger = logging.getLogger(__name__)
+
+
+def make_render_key(latent_key, edits, settings):
+    """Hash everything that determines a rendered image: the inverted face, the edits and render settings"""
+    payload = json.dumps({'latent': latent_key, 'edits': edits, 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def noise_seed(render_key):
+    """Fixed random-noise seed for a render key, so a cached image is the image a re-render would give"""
+    return int(render_key[:8], 16)
+
+
+class RenderCache:
+    """Memoizes rendered images by render key.
+
+    Keys map to image digests in an in-memory LRU and in small index files
+    under <cache_dir>/keys. The encoded images go through the ImageStore and
+    are persisted in cache_dir, which is pruned oldest-first once it grows
+    past max_disk_bytes. With cache_dir=None only the in-memory images count.
+    """
+
+    def __init__(self, image_store, cache_dir='cache/renders', max_entries=1024, max_disk_bytes=1024 ** 3):
+        self.image_store = image_store
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(os.path.join(cache_dir, 'keys'), exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def _index_path(self, key):
+        return os.path.join(self.cache_dir, 'keys', key)
+
+    def _image_path(self, digest, mimetype):
+        return os.path.join(self.cache_dir, ImageStore.filename(digest, mimetype))
+
+    def _available(self, digest, mimetype):
+        if digest in self.image_store:
+            return True
+        return bool(self.cache_dir) and os.path.exists(self._image_path(digest, mimetype))
+
+    def get(self, key):
+        """Return the digest of the image rendered for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None and self.cache_dir:
+            try:
+                with open(self._index_path(key), 'r') as f:
+                    entry = tuple(f.read().split())
+            except OSError:
+                return None
+
+        if entry is None:
+            return None
+        if not self._available(*entry):
+            self._forget(key)
+            return None
+        self._remember(key, entry)
+        return entry[0]
+
+    def put(self, key, data, mimetype='image/png'):
+        """Store an encoded render under key and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        is_new_file = bool(self.cache_dir) and not os.path.exists(self._image_path(digest, mimetype))
+        self.image_store.put(data, mimetype, persist_dir=self.cache_dir)
+
+        if self.cache_dir:
+            tmp_path = self._index_path(key) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(f"{digest} {mimetype}")
+            os.replace(tmp_path, self._index_path(key))
+        self._remember(key, (digest, mimetype))
+
+        if is_new_file:
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._prune()
+        return digest
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._index_path(key))
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Delete the least recently written images until the directory is back under 90% of its budget"""
+        files = sorted((entry for entry in os.scandir(self.cache_dir) if entry.is_file()),
+                       key=lambda entry: entry.stat().st_mtime)
+        removed = 0
+        for entry in files:
+            if self._disk_bytes <= self.max_disk_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            removed += 1
+        logger.info(f"Pruned {removed} cached render(s) from {self.cache_dir}")
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,221 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+from metrics import registry as metrics, collect_timings
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class RenderJob:
+    """A unit of work for the render worker.
+
+    Render jobs carry a latent_key and a payload and are handed to the queue's
+    render function together with any other pending jobs for the same key.
+    Task jobs wrap an arbitrary callable and always run on their own; stepwise
+    tasks return a generator and run one step per turn on the worker.
+    """
+
+    def __init__(self, latent_key=None, payload=None, task=None, stepwise=False):
+        self.id = uuid.uuid4().hex
+        self.latent_key = latent_key
+        self.payload = payload
+        self.task = task
+        self.stepwise = stepwise
+        self.steps = None
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.timings = []
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def set_progress(self, progress):
+        self.progress = max(0.0, min(1.0, float(progress)))
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.status = 'error' if error is not None else 'done'
+        self.progress = 1.0 if error is None else self.progress
+        self.finished = time.time()
+        metrics.inc('render_jobs_total', kind='task' if self.task is not None else 'render', status=self.status)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+        }
+
+    def stage_timings(self):
+        """(stage, seconds) pairs for this job, starting with the time it spent queued"""
+        if self.started is None:
+            return []
+        return [('queue', self.started - self.created)] + list(self.timings)
+
+
+class RenderQueue:
+    """Bounded job queue drained by a single model-holding worker thread.
+
+    render_fn(jobs) receives a list of render jobs that share one latent_key
+    and returns one result per job, so they can be synthesized as one batch.
+    The worker is started lazily on first submit, which keeps it alive in
+    processes forked after import (e.g. gunicorn workers).
+    """
+
+    def __init__(self, render_fn, max_pending=32, max_batch=8, job_ttl=600):
+        self.render_fn = render_fn
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.job_ttl = job_ttl
+        self._pending = deque()
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def submit(self, latent_key, payload):
+        return self._enqueue(RenderJob(latent_key=latent_key, payload=payload))
+
+    def submit_task(self, fn, *args, **kwargs):
+        """Queue an arbitrary callable; it receives the job as its first argument"""
+        return self._enqueue(RenderJob(task=lambda job: fn(job, *args, **kwargs)))
+
+    def submit_steps(self, fn, *args, **kwargs):
+        """Queue a long task as a generator function that receives the job.
+
+        The worker runs it up to each yield and then moves the job to the back
+        of the queue, so other jobs get a turn in between. The generator's
+        return value is the job result.
+        """
+        return self._enqueue(RenderJob(task=lambda job: fn(job, *args, **kwargs), stepwise=True))
+
+    def add_finished(self, result):
+        """Register a job that is already complete (e.g. served from a cache) so it can be polled like any other"""
+        job = RenderJob()
+        job.finish(result=result)
+        with self._cond:
+            self._prune_finished()
+            self._jobs[job.id] = job
+        return job
+
+    def _enqueue(self, job):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(f"Render queue is full ({self.max_pending} pending jobs)")
+            self._prune_finished()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._ensure_worker()
+            self._cond.notify()
+        return job
+
+    def _prune_finished(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker = threading.Thread(target=self._run, name='render-worker', daemon=True)
+        self._worker_pid = os.getpid()
+        self._worker.start()
+
+    def _requeue(self, job):
+        with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+
+    def _run_task(self, job):
+        """Run a task job, or one step of a stepwise one; returns (finished, result)"""
+        if not job.stepwise:
+            return True, job.task(job)
+        if job.steps is None:
+            job.steps = iter(job.task(job))
+        try:
+            next(job.steps)
+        except StopIteration as stop:
+            return True, stop.value
+        return False, None
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            job = self._pending.popleft()
+            if job.task is not None:
+                return [job]
+
+            batch = [job]
+            for other in list(self._pending):
+                if len(batch) >= self.max_batch:
+                    break
+                if other.task is None and other.latent_key == job.latent_key:
+                    self._pending.remove(other)
+                    batch.append(other)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Coalesced jobs share one render, so they also share its stage timings;
+            # a resumed stepwise task keeps adding to its own
+            timings = batch[0].timings if batch[0].started is not None else []
+            started = time.time()
+            for job in batch:
+                job.status = 'running'
+                job.timings = timings
+                if job.started is None:
+                    job.started = started
+                    metrics.observe('render_queue_wait_seconds', started - job.created)
+            try:
+                with collect_timings(timings):
+                    if batch[0].task is not None:
+                        finished, result = self._run_task(batch[0])
+                        if not finished:
+                            self._requeue(batch[0])
+                            continue
+                        results = [result]
+                    else:
+                        if len(batch) > 1:
+                            logger.info(f"Coalesced {len(batch)} render jobs for latent {batch[0].latent_key[:12]}")
+                        results = self.render_fn(batch)
+                metrics.observe('render_batch_size', len(batch), buckets=(1, 2, 4, 8, 16))
+                for job, result in zip(batch, results):
+                    job.finish(result=result)
+            except Exception as e:
+                logger.error(f"Render job failed: {e}")
+                for job in batch:
+                    job.finish(error=str(e))
@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class SessionStore:
+    """Per-upload job directories under the upload and output folders.
+
+    Every upload gets its own ID, with its files in <upload_root>/<id> and its
+    renders in <output_root>/<id>. Sessions that have not been touched for
+    ttl_seconds are removed by collect_garbage.
+    """
+
+    def __init__(self, upload_root, output_root, ttl_seconds=6 * 3600, gc_interval=600):
+        self.upload_root = upload_root
+        self.output_root = output_root
+        self.ttl_seconds = ttl_seconds
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self._gc_lock = threading.Lock()
+        self._meta_lock = threading.Lock()
+        os.makedirs(upload_root, exist_ok=True)
+        os.makedirs(output_root, exist_ok=True)
+
+    @staticmethod
+    def is_valid_id(session_id):
+        return bool(session_id) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+    def upload_dir(self, session_id):
+        return os.path.join(self.upload_root, session_id)
+
+    def output_dir(self, session_id):
+        return os.path.join(self.output_root, session_id)
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir(session_id), exist_ok=True)
+        os.makedirs(self.output_dir(session_id), exist_ok=True)
+        self.save_meta(session_id, {'created': time.time()})
+        logger.info(f"Created session {session_id}")
+        return session_id
+
+    def exists(self, session_id):
+        return self.is_valid_id(session_id) and os.path.isdir(self.upload_dir(session_id))
+
+    def touch(self, session_id):
+        """Mark a session as recently used so garbage collection keeps it"""
+        try:
+            os.utime(self.upload_dir(session_id))
+        except OSError:
+            pass
+
+    def _meta_path(self, session_id):
+        return os.path.join(self.upload_dir(session_id), 'meta.json')
+
+    def load_meta(self, session_id):
+        try:
+            with open(self._meta_path(session_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_meta(self, session_id, meta):
+        tmp_path = self._meta_path(session_id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(session_id))
+
+    def update_meta(self, session_id, **fields):
+        with self._meta_lock:
+            meta = self.load_meta(session_id)
+            meta.update(fields)
+            self.save_meta(session_id, meta)
+        return meta
+
+    def set_image(self, session_id, slot, digest):
+        """Record the content digest of the image last rendered into a named slot"""
+        with self._meta_lock:
+            meta = self.load_meta(session_id)
+            meta.setdefault('images', {})[slot] = digest
+            self.save_meta(session_id, meta)
+        return meta
+
+    def set_sprite(self, session_id, attribute, sprite):
+        """Record the sprite sheet of precomputed frames for one attribute sweep"""
+        with self._meta_lock:
+            meta = self.load_meta(session_id)
+            meta.setdefault('sprites', {})[attribute] = sprite
+            self.save_meta(session_id, meta)
+        return meta
+
+    def collect_garbage(self, now=None):
+        """Remove sessions whose last use is older than the TTL"""
+        now = now or time.time()
+        removed = 0
+        for entry in os.listdir(self.upload_root):
+            if not self.is_valid_id(entry):
+                continue
+            try:
+                last_used = os.path.getmtime(self.upload_dir(entry))
+            except OSError:
+                continue
+            if now - last_used < self.ttl_seconds:
+                continue
+            for folder in (self.upload_dir(entry), self.output_dir(entry)):
+                shutil.rmtree(folder, ignore_errors=True)
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} expired session(s)")
+        self._last_gc = now
+        return removed
+
+    def maybe_collect_garbage(self):
+        """Run garbage collection at most once per gc_interval"""
+        if time.time() - self._last_gc < self.gc_interval:
+            return 0
+        if not self._gc_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self.collect_garbage()
+        finally:
+            self._gc_lock.release()
@@ -1,4 +1,24 @@
 document.addEventListener('DOMContentLoaded', function() {
+    function waitForJob(jobId) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/jobs/${jobId}/events`);
+            source.onmessage = event => {
+                const state = JSON.parse(event.data);
+                if (state.status === 'done') {
+                    source.close();
+                    resolve(state);
+                } else if (state.status === 'error') {
+                    source.close();
+                    reject(new Error(state.error));
+                }
+            };
+            source.onerror = () => {
+                source.close();
+                reject(new Error('Lost connection to the render job.'));
+            };
+        });
+    }
+
     function updateSelectStyles() {
         const selects = document.querySelectorAll('select.form-select');
         selects.forEach(select => {
@@ -111,74 +131,213 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // Apply Changes button functionality
-    const applyChangesBtn = document.getElementById('applyChangesBtn');
-    if (applyChangesBtn) {
-        applyChangesBtn.addEventListener('click', function() {
-            if (!document.getElementById('syntheticImg') || !document.getElementById('syntheticImg').src) {
-                alert('No synthetic image found. Please generate a face first.');
-                return;
-            }
+    function collectCustomizationData() {
+        const combinedSliderValue = parseFloat(document.getElementById('adjustAge').value);
+        let pose_attribute_value = 0.0;
+        let age_attribute_value = 0.0;
+        if (combinedSliderValue <= 0) {
+            pose_attribute_value = 0.0; 
+            age_attribute_value = combinedSliderValue;
+        } else {
+            pose_attribute_value = -combinedSliderValue;
+            age_attribute_value = 0.0; 
+        }
+        return {
+            truncation: parseFloat(document.getElementById('adjustTruncation').value),
+            noise_strength: parseFloat(document.getElementById('adjustNoiseStrength').value),
+            age: age_attribute_value,
+            pose: pose_attribute_value,
+            gender: parseFloat(document.getElementById('adjustGender').value),
+            smile: parseFloat(document.getElementById('adjustSmile').value),
+            lighting: parseFloat(document.getElementById('adjustLighting').value),
+            hair_color: parseFloat(document.getElementById('adjustHairColor').value),
+            hair_length: parseFloat(document.getElementById('adjustHairLength').value),
+            expression: parseFloat(document.getElementById('adjustExpression').value),
+            eye_color: parseFloat(document.getElementById('adjustEyeColor').value),
+            eye_state: parseFloat(document.getElementById('adjustEyeState').value),
+            serious_mood: parseFloat(document.getElementById('adjustSeriousMood').value),
+            maturity: parseFloat(document.getElementById('adjustMaturity').value)
+        };
+    }
+
+    // Every slider change bumps the version; responses older than the shown image are dropped
+    let editVersion = 0;
+    let displayedVersion = 0;
 
+    function showRender(version, src) {
+        if (version < displayedVersion) return false;
+        displayedVersion = version;
+        document.getElementById('syntheticImg').src = src;
+        return true;
+    }
+
+    function applyChanges(scroll) {
+        if (!document.getElementById('syntheticImg') || !document.getElementById('syntheticImg').src) {
+            alert('No synthetic image found. Please generate a face first.');
+            return;
+        }
+
+        if (scroll) {
             document.getElementById('syntheticImg').scrollIntoView({ behavior: 'smooth', block: 'center' });
+        }
 
-            // ... (rest of the logic for collecting data and fetch remains the same) ...
-            const combinedSliderValue = parseFloat(document.getElementById('adjustAge').value);
-            let pose_attribute_value = 0.0;
-            let age_attribute_value = 0.0;
-            if (combinedSliderValue <= 0) {
-                pose_attribute_value = 0.0; 
-                age_attribute_value = combinedSliderValue;
-            } else {
-                pose_attribute_value = -combinedSliderValue;
-                age_attribute_value = 0.0; 
+        // A full render outranks any preview of the same slider state
+        const version = editVersion + 0.5;
+        const customizationData = collectCustomizationData();
+        document.getElementById('customizationLoadingIndicator').style.display = 'block';
+        fetch('/customize', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(customizationData)
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                throw new Error(data.error);
             }
-            const customizationData = {
-                truncation: parseFloat(document.getElementById('adjustTruncation').value),
-                noise_strength: parseFloat(document.getElementById('adjustNoiseStrength').value),
-                age: age_attribute_value,
-                pose: pose_attribute_value,
-                gender: parseFloat(document.getElementById('adjustGender').value),
-                smile: parseFloat(document.getElementById('adjustSmile').value),
-                lighting: parseFloat(document.getElementById('adjustLighting').value),
-                hair_color: parseFloat(document.getElementById('adjustHairColor').value),
-                hair_length: parseFloat(document.getElementById('adjustHairLength').value),
-                expression: parseFloat(document.getElementById('adjustExpression').value),
-                eye_color: parseFloat(document.getElementById('adjustEyeColor').value),
-                eye_state: parseFloat(document.getElementById('adjustEyeState').value),
-                serious_mood: parseFloat(document.getElementById('adjustSeriousMood').value),
-                maturity: parseFloat(document.getElementById('adjustMaturity').value)
-            };
-            document.getElementById('customizationLoadingIndicator').style.display = 'block';
-            fetch('/customize', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(customizationData)
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.synthetic_image) {
-                    document.getElementById('syntheticImg').src = data.synthetic_image;
-                }
-                document.getElementById('truncationValue').textContent = customizationData.truncation;
-                document.getElementById('noiseValue').textContent = customizationData.noise_strength;
-                document.getElementById('genderValue').textContent = customizationData.gender;
-                document.getElementById('smileValue').textContent = customizationData.smile;
-                document.getElementById('lightingValue').textContent = customizationData.lighting;
-                document.getElementById('hairColorValue').textContent = customizationData.hair_color;
-                document.getElementById('hairLengthValue').textContent = customizationData.hair_length;
-                document.getElementById('expressionValue').textContent = customizationData.expression;
-                document.getElementById('eyeColorValue').textContent = customizationData.eye_color;
-                document.getElementById('eyeStateValue').textContent = customizationData.eye_state;
-                document.getElementById('seriousMoodValue').textContent = customizationData.serious_mood;
-                document.getElementById('maturityValue').textContent = customizationData.maturity;
-                document.getElementById('customizationLoadingIndicator').style.display = 'none';
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('An error occurred while processing your request. Please try again.');
-                document.getElementById('customizationLoadingIndicator').style.display = 'none';
+            return waitForJob(data.job_id);
+        })
+        .then(state => {
+            if (state.image_url) {
+                showRender(version, state.image_url);
+            }
+            document.getElementById('truncationValue').textContent = customizationData.truncation;
+            document.getElementById('noiseValue').textContent = customizationData.noise_strength;
+            document.getElementById('genderValue').textContent = customizationData.gender;
+            document.getElementById('smileValue').textContent = customizationData.smile;
+            document.getElementById('lightingValue').textContent = customizationData.lighting;
+            document.getElementById('hairColorValue').textContent = customizationData.hair_color;
+            document.getElementById('hairLengthValue').textContent = customizationData.hair_length;
+            document.getElementById('expressionValue').textContent = customizationData.expression;
+            document.getElementById('eyeColorValue').textContent = customizationData.eye_color;
+            document.getElementById('eyeStateValue').textContent = customizationData.eye_state;
+            document.getElementById('seriousMoodValue').textContent = customizationData.serious_mood;
+            document.getElementById('maturityValue').textContent = customizationData.maturity;
+            document.getElementById('customizationLoadingIndicator').style.display = 'none';
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('An error occurred while processing your request. Please try again.');
+            document.getElementById('customizationLoadingIndicator').style.display = 'none';
+        });
+    }
+
+    // Precomputed single-attribute sweeps, scrubbed locally instead of requesting a preview
+    const sprites = {};
+    let spriteBase = null;
+
+    function loadSprites(attempt) {
+        fetch('/customize/sprites')
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) return;
+            spriteBase = data.base;
+            Object.entries(data.sprites).forEach(([attribute, sprite]) => {
+                if (sprites[attribute]) return;
+                const image = new Image();
+                image.onload = () => { sprites[attribute] = Object.assign({ image: image }, sprite); };
+                image.src = sprite.url;
             });
+            // Sweeps are rendered in the background after upload; check back while they are pending
+            if (data.pending && attempt < 20) {
+                setTimeout(() => loadSprites(attempt + 1), 3000);
+            }
+        })
+        .catch(error => console.error('Sprite error:', error));
+    }
+
+    function spriteFrame(data) {
+        if (!spriteBase) return null;
+        const changed = Object.keys(spriteBase).filter(key => data[key] !== spriteBase[key]);
+        if (changed.length !== 1 || !sprites[changed[0]]) return null;
+
+        const sprite = sprites[changed[0]];
+        const value = data[changed[0]];
+        let index = 0;
+        sprite.values.forEach((v, i) => {
+            if (Math.abs(v - value) < Math.abs(sprite.values[index] - value)) index = i;
+        });
+
+        const size = sprite.frame_size;
+        const canvas = document.createElement('canvas');
+        canvas.width = size;
+        canvas.height = size;
+        canvas.getContext('2d').drawImage(sprite.image,
+            (index % sprite.columns) * size, Math.floor(index / sprite.columns) * size, size, size,
+            0, 0, size, size);
+        return canvas.toDataURL('image/jpeg', 0.9);
+    }
+
+    if (document.getElementById('syntheticImg')) {
+        loadSprites(0);
+    }
+
+    // Live preview while dragging: at most one low-resolution request in flight
+    let previewInFlight = false;
+    let previewPending = false;
+    let previewUrl = null;
+    let fullRenderTimer = null;
+
+    function requestPreview() {
+        if (!document.getElementById('syntheticImg')) return;
+        const frame = spriteFrame(collectCustomizationData());
+        if (frame) {
+            showRender(editVersion, frame);
+            return;
+        }
+        if (previewInFlight) {
+            previewPending = true;
+            return;
+        }
+        previewInFlight = true;
+        const version = editVersion;
+        fetch('/customize/preview', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(collectCustomizationData())
+        })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Preview failed with status ${response.status}`);
+            }
+            return response.blob();
+        })
+        .then(blob => {
+            const url = URL.createObjectURL(blob);
+            if (showRender(version, url)) {
+                if (previewUrl) URL.revokeObjectURL(previewUrl);
+                previewUrl = url;
+            } else {
+                URL.revokeObjectURL(url);
+            }
+        })
+        .catch(error => console.error('Preview error:', error))
+        .finally(() => {
+            previewInFlight = false;
+            if (previewPending) {
+                previewPending = false;
+                requestPreview();
+            }
+        });
+    }
+
+    // Full-resolution render only once the user stops dragging
+    function scheduleFullRender() {
+        clearTimeout(fullRenderTimer);
+        fullRenderTimer = setTimeout(() => applyChanges(false), 400);
+    }
+
+    document.querySelectorAll('input[type="range"], select.form-select').forEach(control => {
+        control.addEventListener('input', () => {
+            editVersion++;
+            requestPreview();
         });
+        control.addEventListener('change', scheduleFullRender);
+    });
+
+    // Apply Changes button functionality
+    const applyChangesBtn = document.getElementById('applyChangesBtn');
+    if (applyChangesBtn) {
+        applyChangesBtn.addEventListener('click', () => applyChanges(true));
     }
 });
\ No newline at end of file
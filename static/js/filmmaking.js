@@ -1,4 +1,25 @@
 document.addEventListener('DOMContentLoaded', function() {
+    function waitForJob(jobId, onProgress) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/jobs/${jobId}/events`);
+            source.onmessage = event => {
+                const state = JSON.parse(event.data);
+                if (onProgress) onProgress(state.progress);
+                if (state.status === 'done') {
+                    source.close();
+                    resolve(state);
+                } else if (state.status === 'error') {
+                    source.close();
+                    reject(new Error(state.error));
+                }
+            };
+            source.onerror = () => {
+                source.close();
+                reject(new Error('Lost connection to the render job.'));
+            };
+        });
+    }
+
     const applyButtons = document.querySelectorAll('.apply-scene-btn');
     const sceneImage = document.getElementById('sceneImg');
     const loadingIndicator = document.getElementById('sceneLoadingIndicator');
@@ -31,11 +52,15 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(response => response.json())
             .then(data => {
-                if (data.new_image_url) {
-                    sceneImage.src = data.new_image_url;
-                } else if (data.error) {
+                if (data.error) {
                     throw new Error(data.error);
                 }
+                return waitForJob(data.job_id);
+            })
+            .then(state => {
+                if (state.image_url) {
+                    sceneImage.src = state.image_url;
+                }
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -59,4 +84,48 @@ document.addEventListener('DOMContentLoaded', function() {
             presetCards.forEach(card => card.classList.remove('active'));
         });
     }
+
+    // Render an interpolated clip between two scenes and offer it as a download
+    const transitionBtn = document.getElementById('renderTransitionBtn');
+    const transitionStatus = document.getElementById('transitionStatus');
+    if (transitionBtn) {
+        transitionBtn.addEventListener('click', function() {
+            transitionBtn.disabled = true;
+            transitionStatus.textContent = 'Queued...';
+
+            fetch('/filmmaking/transition', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    scenes: [document.getElementById('transitionFrom').value,
+                             document.getElementById('transitionTo').value],
+                    frames: parseInt(document.getElementById('transitionFrames').value, 10),
+                    method: document.getElementById('transitionMethod').value
+                }),
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                return waitForJob(data.job_id, progress => {
+                    transitionStatus.textContent = `Rendering frames... ${Math.round(progress * 100)}%`;
+                });
+            })
+            .then(state => {
+                transitionStatus.innerHTML = '';
+                const link = document.createElement('a');
+                link.href = state.download_url;
+                link.textContent = 'Download transition frames (.zip)';
+                transitionStatus.appendChild(link);
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                transitionStatus.textContent = `Could not render the transition: ${error.message}`;
+            })
+            .finally(() => {
+                transitionBtn.disabled = false;
+            });
+        });
+    }
 });
\ No newline at end of file
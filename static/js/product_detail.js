@@ -16,7 +16,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     function updateCarousel() {
         const currentImageUrl = images[currentIndex];
-        carouselImage.src = currentImageUrl + '?t=' + new Date().getTime();
+        carouselImage.src = currentImageUrl;
         imageLabel.textContent = labels[currentIndex];
         
         prevBtn.style.display = currentIndex === 0 ? 'none' : 'flex';
@@ -0,0 +1,69 @@
+"""Latent library routes end to end, through app.test_client() with the benchmark's stand-in models."""
+import io
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('flask')
+
+import benchmark
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory, monkeypatch_module):
+    monkeypatch_module.setenv('LATENT_LIBRARY_DIR', str(tmp_path_factory.mktemp('library')))
+    benchmark.use_stand_in_components()
+    return benchmark.stand_in_client(resolution=64)
+
+
+@pytest.fixture(scope='module')
+def monkeypatch_module():
+    with pytest.MonkeyPatch.context() as mp:
+        yield mp
+
+
+def finish(app_module, client, response):
+    assert response.status_code == 202, response.get_json()
+    job = app_module.render_queue.get(response.get_json()['job_id'])
+    assert job.wait(app_module.RENDER_TIMEOUT)
+    state = client.get(f"/jobs/{job.id}").get_json()
+    assert state['status'] == 'done', state
+    return state
+
+
+def upload(client, seed):
+    response = client.post('/', data={'file': (io.BytesIO(benchmark.test_photo(seed)), 'photo.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+
+
+def test_save_list_similar_use(client):
+    app_module, client = client
+
+    upload(client, 0)
+    first = finish(app_module, client, client.post('/library', json={'name': 'first', 'tags': ['a']}))['entry']
+    upload(client, 1)
+    second = finish(app_module, client, client.post('/library', json={'name': 'second'}))['entry']
+    assert first['thumbnail_url'] and 'row' not in first
+
+    listed = client.get('/library').get_json()
+    assert listed['total'] == 2
+    assert {entry['id'] for entry in listed['entries']} == {first['id'], second['id']}
+
+    by_session = client.get('/library/similar?k=1')
+    assert by_session.status_code == 200
+    assert by_session.get_json()['matches'][0]['id'] == second['id']
+    by_entry = client.get(f"/library/similar?id={first['id']}").get_json()['matches']
+    assert [match['id'] for match in by_entry] == [second['id']]
+
+    used = client.post(f"/library/{first['id']}/use")
+    assert used.status_code == 200
+    assert used.get_json()['entry']['id'] == first['id']
+    assert client.get(used.get_json()['image_url']).status_code == 200
+
+
+def test_rejects_bad_numbers(client):
+    app_module, client = client
+    assert client.get('/library?limit=many').status_code == 400
+    assert client.get('/library/similar?k=0').status_code == 400
+    assert client.get('/library/similar?k=-1').status_code == 400
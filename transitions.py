@@ -0,0 +1,105 @@
+"""Interpolated transitions between edit sets, rendered and encoded batch by batch.
+
+Frames flow through generators from interpolation to synthesis to the
+archive writer, so a clip is never held in memory as a whole, and the
+writer yields after every synthesis batch so a caller can pause between them.
+"""
+import os
+import json
+import zipfile
+import logging
+from itertools import islice
+
+import numpy as np
+
+from inversion_utils import split_edits, render_variations, image_to_bytes, synthesis_batch_size
+
+logger = logging.getLogger(__name__)
+
+INTERPOLATION_METHODS = ('linear', 'slerp')
+
+
+def slerp(a, b, t):
+    """Spherical interpolation of the direction of two edit vectors, with their length interpolated linearly.
+
+    Falls back to linear interpolation when either vector is (close to)
+    zero or the two point the same way.
+    """
+    norm_a, norm_b = np.linalg.norm(a), np.linalg.norm(b)
+    if norm_a < 1e-6 or norm_b < 1e-6:
+        return (1 - t) * a + t * b
+    unit_a, unit_b = a / norm_a, b / norm_b
+    omega = np.arccos(np.clip(np.dot(unit_a, unit_b), -1.0, 1.0))
+    if omega < 1e-4:
+        return (1 - t) * a + t * b
+    direction = (np.sin((1 - t) * omega) * unit_a + np.sin(t * omega) * unit_b) / np.sin(omega)
+    return direction * ((1 - t) * norm_a + t * norm_b)
+
+
+def count_frames(num_keyframes, frames_per_segment):
+    return (num_keyframes - 1) * frames_per_segment + 1
+
+
+def interpolate_edits(keyframes, frames_per_segment, method='linear'):
+    """Yield edits dicts that move through the keyframe edit sets in order.
+
+    Each transition takes frames_per_segment frames and the sequence ends
+    exactly on the last keyframe. Attribute strengths follow method;
+    truncation and noise strength are always interpolated linearly.
+    """
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError(f"Unknown interpolation method {method!r}, expected one of {INTERPOLATION_METHODS}")
+
+    split = [split_edits(edits) for edits in keyframes]
+    names = sorted({name for _, _, attributes in split for name in attributes})
+    points = [(np.array([attributes.get(name, 0.0) for name in names]), truncation, noise_strength)
+              for truncation, noise_strength, attributes in split]
+
+    def frame(start, end, t):
+        (vec_a, trunc_a, noise_a), (vec_b, trunc_b, noise_b) = start, end
+        vec = slerp(vec_a, vec_b, t) if method == 'slerp' else (1 - t) * vec_a + t * vec_b
+        edits = dict(zip(names, vec.tolist()))
+        edits['truncation'] = (1 - t) * trunc_a + t * trunc_b
+        edits['noise_strength'] = (1 - t) * noise_a + t * noise_b
+        return edits
+
+    for start, end in zip(points, points[1:]):
+        for step in range(frames_per_segment):
+            yield frame(start, end, step / frames_per_segment)
+    yield frame(points[-1], points[-1], 1.0)
+
+
+def render_frame_batches(latent_codes, generator, edits_iter, batch_size=None, noise_seed=0):
+    """Render a stream of edits dicts, yielding the frames of each synthesis batch as it finishes.
+
+    batch_size defaults to what fits in memory (synthesis_batch_size). Every
+    frame shares one noise seed so fine texture stays put between frames.
+    """
+    batch_size = batch_size or synthesis_batch_size(generator)
+    edits_iter = iter(edits_iter)
+    while True:
+        batch = list(islice(edits_iter, batch_size))
+        if not batch:
+            return
+        yield render_variations(latent_codes, generator, batch, batch_size=batch_size,
+                                noise_seeds=[noise_seed] * len(batch))
+
+
+def write_frame_archive(batches, path, fps=24, quality=90, manifest=None):
+    """Stream frame batches into a ZIP of numbered JPEGs plus a manifest.json.
+
+    A generator: it yields the number of frames written so far after every
+    batch, and returns the total once the archive is in place.
+    """
+    tmp_path = path + '.tmp'
+    count = 0
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for frames in batches:
+            for frame in frames:
+                count += 1
+                archive.writestr(f"frame_{count:05d}.jpg", image_to_bytes(frame, format='JPEG', quality=quality))
+            yield count
+        archive.writestr('manifest.json', json.dumps(dict(manifest or {}, fps=fps, frames=count)))
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote {count} frames to {path}")
+    return count